@@ -1,8 +1,10 @@
 
 import streamlit as st
-from ollama_utils import get_available_models, get_chat_response, get_file_path, load_prompts, list_log_files, parse_dialogue, get_speakers, generate_dialogue_response, generate_multiple_responses
+from ollama_utils import get_available_models, get_model_state, warm_up_model, get_chat_response, get_file_path, load_prompts, list_log_files, start_directory_index, configure_response_cache, configure_metrics, start_metrics_server, start_pregeneration_scheduler, get_speakers, get_dialogue, get_dialogue_window, generate_dialogue_response, generate_multiple_responses, stream_dialogue_response
 from pathlib import Path
+import logging
 import toml
+import uuid
 
 
 # Charger les prompts
@@ -14,9 +16,58 @@ if config_path.exists():
     config = toml.load(config_path)
     dialogue_dirs = config.get("dialogue_dirs", {}).get("dirs", ["dialogues_text"])
     active_dir = config.get("dialogue_dirs", {}).get("active", dialogue_dirs[0])
+    generation_config = config.get("generation", {})
+    watch_polling = config.get("dialogue_dirs", {}).get("polling", False)
+    cache_config = config.get("cache", {})
+    metrics_config = config.get("metrics", {})
+    pregeneration_config = config.get("pregeneration", {})
+    display_config = config.get("display", {})
 else:
     dialogue_dirs = ["dialogues_text"]
     active_dir = "dialogues_text"
+    generation_config = {}
+    watch_polling = False
+    cache_config = {}
+    metrics_config = {}
+    pregeneration_config = {}
+    display_config = {}
+prompt_layout = generation_config.get("prompt_layout", "stable")
+keep_alive = generation_config.get("keep_alive")
+context_budget = generation_config.get("context_budget")
+
+# Index des dossiers surveillé par watchdog, partagé par toutes les sessions :
+# list_log_files est alors servi depuis la mémoire.
+start_directory_index(dialogue_dirs, polling=watch_polling)
+
+# Cache de réponses (optionnel) : LRU en mémoire + SQLite sur disque
+# (configuré seulement si [cache] enabled = true, pour ne pas créer la base sinon)
+response_cache = None
+if cache_config.get("enabled", False):
+    response_cache = configure_response_cache(
+        max_entries=cache_config.get("max_entries", 256),
+        db_path=cache_config.get("path", ".cache/responses.sqlite3"),
+        max_db_bytes=int(cache_config.get("max_disk_mb", 50) * 1024 * 1024),
+    )
+
+# Journalisation (niveau DEBUG pour voir les messages envoyés à Ollama) et métriques par appel
+logging.basicConfig(level=metrics_config.get("log_level", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+metrics = configure_metrics(
+    window=metrics_config.get("window", 500),
+    jsonl_path=metrics_config.get("jsonl_path") or None,
+    prometheus_path=metrics_config.get("prometheus_path") or None,
+)
+if metrics_config.get("prometheus_port"):
+    start_metrics_server(metrics_config["prometheus_port"])
+
+# Pré-génération des réponses du prochain personnage, déclenchée par l'index de dossiers
+pregeneration = start_pregeneration_scheduler(
+    num_candidates=pregeneration_config.get("candidates", 1),
+    max_pending=pregeneration_config.get("max_pending", 2),
+)
+# Le planificateur est partagé : chaque session (onglet) y garde son fichier actif et ses réglages
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+session_id = st.session_state.session_id
 
 st.header("Dossiers de dialogues")
 selected_dir = st.selectbox("Choisir le dossier de dialogues :", dialogue_dirs, index=dialogue_dirs.index(active_dir) if active_dir in dialogue_dirs else 0, key="selectbox_dossier")
@@ -57,7 +108,7 @@ if dialogue_files:
     # ...existing code...
 
 
-    speakers = get_speakers(parse_dialogue(selected_file_path))
+    speakers = get_speakers(selected_file_path)
     if speakers:
 
             # Ajout de la configuration du prompt système
@@ -89,7 +140,12 @@ if dialogue_files:
             top_p = st.slider("Top P", 0.0, 1.0, 0.9, 0.1, key=f"slider_top_p_{st.session_state.selected_file_name}")
             max_tokens = st.slider("Max Tokens", 10, 500, 50, 10, key=f"slider_max_tokens_{st.session_state.selected_file_name}")
             models = get_available_models()
-            model_name = st.selectbox("Choisissez un modèle Ollama :", models, key=f"selectbox_model_{st.session_state.selected_file_name}")
+            model_state_labels = {"cold": "⚪ froid", "loading": "🟡 chargement", "warm": "🟢 prêt", "error": "🔴 erreur"}
+            model_name = st.selectbox("Choisissez un modèle Ollama :", models, key=f"selectbox_model_{st.session_state.selected_file_name}",
+                                      format_func=lambda name: f"{name} — {model_state_labels[get_model_state(name)]}")
+            # Précharge le modèle choisi en arrière-plan avant le clic sur « Générer »
+            warm_up_model(model_name, keep_alive=keep_alive)
+            st.caption(f"État du modèle : {model_state_labels[get_model_state(model_name)]}")
 
             # Rechoix du fichier de dialogue après le modèle
             dialogue_files = list_log_files(selected_dir)
@@ -104,7 +160,7 @@ if dialogue_files:
                 if selected_file_name_secondary != st.session_state.selected_file_name:
                     st.session_state.selected_file_name = selected_file_name_secondary
                     selected_file_path = next(f for f in dialogue_files if Path(f).name == selected_file_name_secondary)
-                    speakers = get_speakers(parse_dialogue(selected_file_path))
+                    speakers = get_speakers(selected_file_path)
             
             # Choix du personnage (mis à jour avec les nouveaux speakers)
             character = st.selectbox("Choisir le personnage à faire parler :", speakers, key=f"selectbox_character_{st.session_state.selected_file_name}")
@@ -114,14 +170,19 @@ if dialogue_files:
             # Affichage du dialogue juste sous le choix du personnage
             
             # Affichage du dialogue juste sous le choix du personnage
-            with open(selected_file_path, "r", encoding="utf-8") as f:
-                dialogue_text = f.read()
-            # Nettoie les lignes vides tout en gardant l'ordre normal
-            dialogue_lines = dialogue_text.split('\n')
-            dialogue_lines = [line for line in dialogue_lines if line.strip()]
-            dialogue_text = '\n'.join(dialogue_lines)
+            # Seules les dernières pages sont envoyées au navigateur ; les pages
+            # précédentes sont chargées à la demande
             st.subheader("📜 Dialogue actuel")
-            dialogue_html = dialogue_text.replace('\n', '<br>')
+            page_lines = display_config.get("page_lines", 200)
+            pages_key = f"dialogue_pages_{st.session_state.selected_file_name}"
+            if pages_key not in st.session_state:
+                st.session_state[pages_key] = 1
+            visible_lines, first_line, total_lines = get_dialogue_window(selected_file_path, st.session_state[pages_key], page_lines)
+            if first_line > 0:
+                if st.button(f"⬆️ Charger les {min(page_lines, first_line)} lignes précédentes ({first_line} non affichées)", key=f"load_earlier_{st.session_state.selected_file_name}"):
+                    st.session_state[pages_key] += 1
+                    visible_lines, first_line, total_lines = get_dialogue_window(selected_file_path, st.session_state[pages_key], page_lines)
+            dialogue_html = '<br>'.join(visible_lines)
             
             # Utilise CSS pour forcer le scroll en bas
             st.markdown("""
@@ -155,6 +216,8 @@ if dialogue_files:
                 </div>
             </div>
             ''', unsafe_allow_html=True)
+            if first_line > 0:
+                st.caption(f"Lignes {first_line + 1} à {total_lines} sur {total_lines}")
 
             # Prompt utilisateur après le personnage
             user_prompt_options = list(prompts.get("user_prompts", {}).keys())
@@ -179,22 +242,72 @@ if dialogue_files:
             local_user_prompt = st.text_area("Prompt utilisateur (éditable - utilisez {character} pour le nom du personnage):", value=default_user, height=80, key=f"textarea_user_{selected_file_name}")
             final_user_prompt = local_user_prompt.replace("{character}", character)
 
+            streaming = st.checkbox("Affichage en continu (streaming)", value=True, key=f"checkbox_streaming_{selected_file_name}")
+            use_cache = response_cache is not None and st.checkbox("Réutiliser les réponses en cache", value=True, key="checkbox_use_cache",
+                                                                   help="Implique le mode déterministe : seules des générations à graine fixe peuvent être resservies.")
+            deterministic = st.checkbox("Mode déterministe (graine fixe)", value=cache_config.get("deterministic", False) or use_cache,
+                                        disabled=use_cache, key="checkbox_deterministic") or use_cache
+            pregenerate = st.checkbox("Pré-générer la réponse du prochain personnage", value=pregeneration_config.get("enabled", False), key="checkbox_pregenerate")
+            if pregenerate:
+                pregeneration.configure(model_name, system_prompt, local_user_prompt, {"temperature": temperature, "top_p": top_p, "max_tokens": max_tokens},
+                                        prompt_layout=prompt_layout, keep_alive=keep_alive, context_budget=context_budget, deterministic=deterministic,
+                                        session=session_id)
+                pregeneration.set_active(selected_file_path, session=session_id)
+                ready = pregeneration.ready(selected_file_path, session=session_id)
+                if ready:
+                    st.caption(f"⚡ Réponse pré-générée prête pour : {', '.join(ready)}")
+            else:
+                pregeneration.set_active(None, session=session_id)
             if st.button("Générer une réponse", key=f"gen_response_{selected_file_name}_{character}"):
-                # Rafraîchit le dialogue en arrière-plan avant la génération
-                with open(selected_file_path, "r", encoding="utf-8") as f:
-                    dialogue_text = f.read()
-                dialogue_lines = parse_dialogue(selected_file_path)
-                response = generate_dialogue_response(model_name, character, dialogue_lines, system_prompt, final_user_prompt, {"temperature": temperature, "top_p": top_p, "max_tokens": max_tokens})
-                
+                # Rafraîchit le dialogue (seules les lignes ajoutées sont parsées)
+                dialogue_lines = get_dialogue(selected_file_path)
+                options = {"temperature": temperature, "top_p": top_p, "max_tokens": max_tokens}
+
                 # Affiche seulement la réponse du personnage
                 st.subheader(f"**{character}**")
-                st.markdown(f'''<div style="font-size:1.25em;font-weight:500;border-radius:14px;border:2px solid #f59e42;background:#fff7e7;padding:18px 22px 14px 22px;margin:12px 0;color:#332a1e;box-shadow:0 2px 12px #f59e4233;">{response[0]}</div>''', unsafe_allow_html=True)
-                st.write(f"*Instruction : {response[1]}*")
+                # Réponse déjà générée en arrière-plan pour cette fin de dialogue : servie immédiatement
+                pregenerated = pregeneration.take(selected_file_path, character, session=session_id) if pregenerate else None
+                if pregenerated:
+                    st.markdown(f'''<div style="font-size:1.25em;font-weight:500;border-radius:14px;border:2px solid #f59e42;background:#fff7e7;padding:18px 22px 14px 22px;margin:12px 0;color:#332a1e;box-shadow:0 2px 12px #f59e4233;">{pregenerated[0]}</div>''', unsafe_allow_html=True)
+                    st.caption("⚡ Réponse pré-générée")
+                    st.write(f"*Instruction : {pregenerated[1]}*")
+                elif streaming:
+                    stats = {}
+                    response_placeholder = st.empty()
+                    response_text = ""
+                    with pregeneration.interactive():
+                        for delta in stream_dialogue_response(model_name, character, dialogue_lines, system_prompt, final_user_prompt, options, stats=stats, prompt_layout=prompt_layout, keep_alive=keep_alive, use_cache=use_cache, deterministic=deterministic, context_budget=context_budget):
+                            response_text += delta
+                            response_placeholder.markdown(f'''<div style="font-size:1.25em;font-weight:500;border-radius:14px;border:2px solid #f59e42;background:#fff7e7;padding:18px 22px 14px 22px;margin:12px 0;color:#332a1e;box-shadow:0 2px 12px #f59e4233;">{response_text}</div>''', unsafe_allow_html=True)
+                    if stats.get("time_to_first_token") is not None:
+                        st.caption(f"⏱️ Premier token : {stats['time_to_first_token']:.2f} s — total : {stats['total_time']:.2f} s{' (cache)' if stats['cached'] else ''}")
+                    st.write(f"*Instruction : {stats['instruction']}*")
+                else:
+                    with pregeneration.interactive():
+                        response = generate_dialogue_response(model_name, character, dialogue_lines, system_prompt, final_user_prompt, options, prompt_layout=prompt_layout, keep_alive=keep_alive, use_cache=use_cache, deterministic=deterministic, context_budget=context_budget)
+                    st.markdown(f'''<div style="font-size:1.25em;font-weight:500;border-radius:14px;border:2px solid #f59e42;background:#fff7e7;padding:18px 22px 14px 22px;margin:12px 0;color:#332a1e;box-shadow:0 2px 12px #f59e4233;">{response[0]}</div>''', unsafe_allow_html=True)
+                    st.write(f"*Instruction : {response[1]}*")
 
             num_responses = st.slider("Nombre de réponses à générer :", 1, 5, 3)
             if st.button("Générer plusieurs réponses"):
-                dialogue_lines = parse_dialogue(selected_file_path)
-                responses = generate_multiple_responses(model_name, character, dialogue_lines, system_prompt, final_user_prompt, {"temperature": temperature, "top_p": top_p, "max_tokens": max_tokens}, num_responses=num_responses)
+                dialogue_lines = get_dialogue(selected_file_path)
+                with pregeneration.interactive():
+                    responses = generate_multiple_responses(model_name, character, dialogue_lines, system_prompt, final_user_prompt, {"temperature": temperature, "top_p": top_p, "max_tokens": max_tokens}, num_responses=num_responses,
+                                                            max_workers=generation_config.get("max_workers"), request_timeout=generation_config.get("request_timeout"),
+                                                            prompt_layout=prompt_layout, keep_alive=keep_alive, use_cache=use_cache, deterministic=deterministic, context_budget=context_budget)
                 for i, resp in enumerate(responses, 1):
                     st.subheader(f"**Option {i} : {character}**")
                     st.markdown(f'''<div style="font-size:1.25em;font-weight:500;border-radius:14px;border:2px solid #f59e42;background:#fff7e7;padding:18px 22px 14px 22px;margin:12px 0;color:#332a1e;box-shadow:0 2px 12px #f59e4233;">{resp}</div>''', unsafe_allow_html=True)
+
+            # Compteurs du cache de réponses, après les générations de ce rerun
+            if response_cache is not None:
+                cache_stats = response_cache.stats
+                st.caption(f"🗄️ Cache : {cache_stats['hits']} hits / {cache_stats['misses']} misses — {cache_stats['entries']} en mémoire, {cache_stats['disk_bytes'] / 1024:.0f} Ko sur disque")
+
+            # Panneau de performances : centiles glissants par modèle, point d'entrée et personnage
+            with st.expander("📊 Performances"):
+                metrics_rows = metrics.summary()
+                if metrics_rows:
+                    st.dataframe(metrics_rows, use_container_width=True)
+                else:
+                    st.write("Aucun appel enregistré pour l'instant.")
@@ -0,0 +1,220 @@
+"""Génération en lot, sans interface, pour des dossiers entiers de dialogues.
+
+Chaque tâche (job) correspond à un fichier de dialogue et un personnage :
+K réponses candidates sont générées avec generate_multiple_responses. Les
+tâches s'exécutent dans un pool borné, chaque résultat est écrit dans le
+fichier JSONL de sortie dès qu'il est prêt, et une exécution interrompue
+reprend en sautant les tâches déjà terminées.
+
+Usage :
+    python batch_generate.py --model mistral:latest --output sorties.jsonl
+    python batch_generate.py --model mistral:latest --dirs dialogues_text Texte -k 5 --workers 4
+    python batch_generate.py --model mistral:latest --jobs taches.jsonl --output sorties.jsonl
+
+Format d'une ligne de --jobs : {"file": "...", "character": "...", "num_responses": 3, "job_id": "..."}
+(seul "file" est obligatoire ; sans "character", une tâche est créée par personnage).
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import argparse
+import json
+import os
+import threading
+import time
+
+import toml
+
+from ollama_utils import DEFAULT_PROMPT_LAYOUT, generate_multiple_responses, get_dialogue, list_log_files, load_prompts
+
+
+def make_job_id(file_path, character):
+    """Identifiant stable d'une tâche, utilisé pour la reprise."""
+    return f"{os.path.abspath(file_path)}#{character}"
+
+
+def _speaker_jobs(file_path, num_responses, job_id=None):
+    try:
+        speakers = get_dialogue(file_path).speakers
+    except (OSError, ValueError) as e:
+        # Fichier manquant ou illisible : une tâche en échec, notée dans la sortie, plutôt qu'un lot interrompu
+        yield {'job_id': job_id or os.path.abspath(file_path), 'file': str(file_path), 'character': None,
+               'num_responses': num_responses, 'error': f"{type(e).__name__}: {e}"}
+        return
+    for character in speakers:
+        yield {'job_id': f"{job_id}#{character}" if job_id else make_job_id(file_path, character),
+               'file': str(file_path), 'character': character, 'num_responses': num_responses}
+
+
+def jobs_from_dirs(dirs, num_responses=3):
+    """Génère une tâche par personnage et par fichier .txt des dossiers (une tâche en échec par fichier illisible)."""
+    for folder in dirs:
+        for file_path in list_log_files(folder):
+            yield from _speaker_jobs(file_path, num_responses)
+
+
+def jobs_from_jsonl(jobs_path, num_responses=3):
+    """Lit les tâches depuis un fichier JSONL (une tâche par ligne)."""
+    with open(jobs_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            if 'file' not in job:
+                raise ValueError(f"{jobs_path}:{line_number}: champ 'file' manquant")
+            job_id = job.get('job_id') or job.get('request_id')
+            count = job.get('num_responses', num_responses)
+            if job.get('character'):
+                yield {'job_id': job_id or make_job_id(job['file'], job['character']),
+                       'file': job['file'], 'character': job['character'], 'num_responses': count}
+            else:
+                yield from _speaker_jobs(job['file'], count, job_id)
+
+
+def load_finished_jobs(output_path):
+    """Retourne les identifiants des tâches déjà terminées sans erreur dans le fichier de sortie."""
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # ligne tronquée par une interruption
+            if record.get('ok'):
+                finished.add(record['job_id'])
+    return finished
+
+
+def run_batch(jobs, model_name, output_path, system_prompt="", user_prompt="", options=None, context_lines=None,
+              workers=2, candidate_workers=1, request_timeout=None, prompt_layout=DEFAULT_PROMPT_LAYOUT,
+              keep_alive=None, deterministic=False, resume=True, progress=None, context_budget=None):
+    """Exécute les tâches et écrit un enregistrement JSONL par tâche terminée.
+
+    Le résumé glissant des répliques anciennes n'est pas utilisé : il est mis
+    à jour en arrière-plan et rendrait les prompts (donc le lot) non reproductibles.
+    Retourne un résumé : tâches, générations, erreurs, durée, générations/s et tokens/s.
+    """
+    jobs = list(jobs)
+    finished = load_finished_jobs(output_path) if resume else set()
+    pending = [job for job in jobs if job['job_id'] not in finished]
+    write_lock = threading.Lock()
+    usage = {}
+    summary = {'jobs': len(pending), 'skipped': len(jobs) - len(pending), 'generations': 0, 'errors': 0}
+
+    def generate_job(job, started):
+        dialogue = get_dialogue(job['file']).snapshot()
+        character_prompt = user_prompt.replace("{character}", job['character'])
+        responses = generate_multiple_responses(
+            model_name, job['character'], dialogue, system_prompt, character_prompt, options, context_lines,
+            num_responses=job['num_responses'], max_workers=candidate_workers, request_timeout=request_timeout,
+            prompt_layout=prompt_layout, keep_alive=keep_alive, deterministic=deterministic, usage=usage,
+            context_budget=context_budget, summarize=False)
+        errors = sum(1 for response in responses if response.startswith("Erreur:"))
+        return {
+            'job_id': job['job_id'], 'file': job['file'], 'character': job['character'], 'model': model_name,
+            'turns': len(dialogue), 'responses': responses, 'errors': errors, 'ok': errors == 0,
+            'duration': round(time.perf_counter() - started, 3),
+        }
+
+    def failed_record(job, error, started):
+        return {
+            'job_id': job['job_id'], 'file': job['file'], 'character': job['character'], 'model': model_name,
+            'responses': [], 'errors': 1, 'ok': False, 'error': error,
+            'duration': round(time.perf_counter() - started, 3),
+        }
+
+    def run_job(job):
+        started = time.perf_counter()
+        if job.get('error'):
+            # Fichier illisible dès le listage des tâches
+            return failed_record(job, job['error'], started)
+        try:
+            return generate_job(job, started)
+        except Exception as e:
+            # Fichier manquant, illisible... : la tâche est notée en échec et sera reprise
+            return failed_record(job, f"{type(e).__name__}: {e}", started)
+
+    started = time.perf_counter()
+    with open(output_path, 'a', encoding='utf-8') as out, ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch") as executor:
+        futures = [executor.submit(run_job, job) for job in pending]
+        for done, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+            summary['generations'] += sum(1 for response in record['responses'] if not response.startswith("Erreur:"))
+            summary['errors'] += record['errors']
+            if progress:
+                progress(done, len(pending), record)
+
+    elapsed = time.perf_counter() - started
+    summary['duration'] = elapsed
+    summary['eval_count'] = usage.get('eval_count', 0)
+    summary['generations_per_s'] = summary['generations'] / elapsed if elapsed > 0 else 0.0
+    summary['tokens_per_s'] = summary['eval_count'] / elapsed if elapsed > 0 else 0.0
+    return summary
+
+
+def _resolve_prompt(value, prompts):
+    """Retourne le prompt nommé dans prompts.toml, ou la valeur telle quelle."""
+    return prompts.get(value, value) if value else ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Génération en lot de réponses pour des dossiers de dialogues.")
+    parser.add_argument("--model", required=True, help="Modèle Ollama à utiliser")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--dirs", nargs="+", help="Dossiers de dialogues (par défaut : dialogue_dirs de config.toml)")
+    source.add_argument("--jobs", help="Fichier JSONL de tâches")
+    parser.add_argument("--output", default="batch_output.jsonl", help="Fichier JSONL de sortie (complété, jamais écrasé)")
+    parser.add_argument("-k", "--num-responses", type=int, default=3, help="Réponses candidates par personnage et par fichier")
+    parser.add_argument("--workers", type=int, default=2, help="Tâches exécutées en parallèle")
+    parser.add_argument("--candidate-workers", type=int, default=1, help="Candidates générées en parallèle par tâche")
+    parser.add_argument("--system-prompt", default="", help="Nom d'un prompt système de prompts.toml, ou texte libre")
+    parser.add_argument("--user-prompt", default="", help="Nom d'un prompt utilisateur de prompts.toml, ou texte libre ({character} est remplacé)")
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--top-p", type=float, default=0.9)
+    parser.add_argument("--max-tokens", type=int, default=50)
+    parser.add_argument("--context-lines", type=int, default=None, help="Nombre maximal de répliques de contexte (par défaut : selon le budget de tokens)")
+    parser.add_argument("--context-budget", type=int, default=None, help="Budget de tokens du contexte (par défaut : déduit de num_ctx)")
+    parser.add_argument("--deterministic", action="store_true", help="Graines fixes pour des lots reproductibles")
+    parser.add_argument("--no-resume", action="store_true", help="Ne pas sauter les tâches déjà présentes dans la sortie")
+    args = parser.parse_args()
+
+    config_path = Path("config.toml")
+    config = toml.load(config_path) if config_path.exists() else {}
+    generation_config = config.get("generation", {})
+
+    if args.jobs:
+        jobs = list(jobs_from_jsonl(args.jobs, args.num_responses))
+    else:
+        dirs = args.dirs or config.get("dialogue_dirs", {}).get("dirs", ["dialogues_text"])
+        jobs = list(jobs_from_dirs(dirs, args.num_responses))
+
+    prompts = load_prompts()
+    system_prompt = _resolve_prompt(args.system_prompt, prompts.get("system_prompts", {}))
+    user_prompt = _resolve_prompt(args.user_prompt, prompts.get("user_prompts", {}))
+
+    def progress(done, total, record):
+        status = "ok" if record['ok'] else record.get('error') or f"{record['errors']} erreur(s)"
+        print(f"[{done}/{total}] {Path(record['file']).name} — {record['character'] or '?'} : {status} ({record['duration']:.1f} s)")
+
+    summary = run_batch(
+        jobs, args.model, args.output, system_prompt, user_prompt,
+        {"temperature": args.temperature, "top_p": args.top_p, "max_tokens": args.max_tokens}, args.context_lines,
+        workers=args.workers, candidate_workers=args.candidate_workers,
+        request_timeout=generation_config.get("request_timeout"),
+        prompt_layout=generation_config.get("prompt_layout", DEFAULT_PROMPT_LAYOUT),
+        keep_alive=generation_config.get("keep_alive"), deterministic=args.deterministic,
+        resume=not args.no_resume, progress=progress,
+        context_budget=args.context_budget or generation_config.get("context_budget"))
+
+    print(f"\n{summary['jobs']} tâche(s) exécutée(s), {summary['skipped']} déjà terminée(s)")
+    print(f"{summary['generations']} génération(s), {summary['errors']} erreur(s) en {summary['duration']:.1f} s")
+    print(f"Débit : {summary['generations_per_s']:.2f} générations/s, {summary['tokens_per_s']:.1f} tokens/s")
+
+
+if __name__ == "__main__":
+    main()
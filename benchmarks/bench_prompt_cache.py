@@ -0,0 +1,75 @@
+"""Mesure l'effet de la disposition des prompts sur le cache de prompt d'Ollama.
+
+Lance plusieurs générations successives sur le même dialogue avec chaque
+disposition ("legacy" puis "stable") et compare prompt_eval_count et
+prompt_eval_duration rapportés par Ollama. Avec la disposition stable, les
+appels après le premier ne réévaluent que la fin du prompt.
+
+Usage :
+    python benchmarks/bench_prompt_cache.py --model mistral:latest --file dialogues_text/dialogue1.txt --runs 5
+"""
+from pathlib import Path
+import argparse
+import statistics
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ollama import chat  # noqa: E402
+from ollama_utils import PROMPT_LAYOUTS, _build_dialogue_messages, get_speakers, load_prompts, parse_dialogue  # noqa: E402
+
+
+def run_layout(model_name, character, dialogue, system_prompt, user_prompt, layout, runs, keep_alive, max_tokens):
+    """Enchaîne runs générations et retourne la liste (prompt_eval_count, prompt_eval_duration en ms)."""
+    samples = []
+    for _ in range(runs):
+        messages, _instruction = _build_dialogue_messages(character, dialogue, system_prompt, user_prompt, prompt_layout=layout)
+        response = chat(
+            model=model_name,
+            messages=messages,
+            options={'num_predict': max_tokens},
+            keep_alive=keep_alive
+        )
+        samples.append((response.get('prompt_eval_count', 0) or 0, (response.get('prompt_eval_duration', 0) or 0) / 1e6))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", required=True, help="Modèle Ollama à utiliser")
+    parser.add_argument("--file", default="dialogues_text/dialogue1.txt", help="Fichier de dialogue")
+    parser.add_argument("--character", help="Personnage (par défaut : le premier trouvé)")
+    parser.add_argument("--runs", type=int, default=5, help="Générations par disposition")
+    parser.add_argument("--keep-alive", default="10m", help="Durée de maintien du modèle en mémoire")
+    parser.add_argument("--max-tokens", type=int, default=32, help="Tokens générés par appel")
+    args = parser.parse_args()
+
+    dialogue = parse_dialogue(args.file)
+    character = args.character or sorted(get_speakers(dialogue))[0]
+    prompts = load_prompts()
+    system_prompt = next(iter(prompts.get("system_prompts", {}).values()), "")
+    user_prompt = next(iter(prompts.get("user_prompts", {}).values()), "")
+
+    # Charge le modèle une fois pour ne pas compter le chargement dans la première mesure
+    chat(model=args.model, messages=[], keep_alive=args.keep_alive)
+
+    print(f"Modèle : {args.model} — fichier : {args.file} — personnage : {character}")
+    results = {}
+    for layout in PROMPT_LAYOUTS[::-1]:
+        samples = run_layout(args.model, character, dialogue, system_prompt, user_prompt, layout, args.runs, args.keep_alive, args.max_tokens)
+        results[layout] = samples
+        print(f"\n[{layout}]")
+        for i, (count, duration) in enumerate(samples, 1):
+            print(f"  appel {i}: prompt_eval_count={count:5d}  prompt_eval_duration={duration:8.1f} ms")
+
+    # Les appels répétés (après le premier) sont ceux qui profitent du cache
+    repeated = {layout: [d for _, d in samples[1:]] or [d for _, d in samples] for layout, samples in results.items()}
+    legacy_ms = statistics.mean(repeated["legacy"])
+    stable_ms = statistics.mean(repeated["stable"])
+    print(f"\nprompt_eval_duration moyen (appels répétés) : legacy={legacy_ms:.1f} ms, stable={stable_ms:.1f} ms")
+    if legacy_ms > 0:
+        print(f"Réduction : {100 * (1 - stable_ms / legacy_ms):.1f} %")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""Suite de mesures hors ligne : génération, parsing et listage, sans vrai Ollama.
+
+Les chemins de génération d'ollama_utils sont mesurés contre le serveur
+simulé de fake_ollama.py (latence par token, temps de chargement et
+concurrence réglables) ; le parsing et le listage utilisent des dialogues et
+des dossiers synthétiques générés dans un dossier temporaire. Pour chaque
+scénario : latence p50/p95, débit et pic mémoire (tracemalloc, sur une
+exécution séparée pour ne pas fausser les temps).
+
+Les résultats sont comparés à une référence enregistrée (--save-baseline) :
+une métrique dégradée de plus de --threshold est signalée comme régression
+et le script se termine avec le code 1.
+
+Usage :
+    python benchmarks/bench_suite.py --quick
+    python benchmarks/bench_suite.py --save-baseline
+    python benchmarks/bench_suite.py --only parse_dialogue list_log_files --lines 1000000
+    python benchmarks/bench_suite.py --token-latency 0.02 --load-time 1 --max-concurrency 2
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import ollama_utils  # noqa: E402
+from fake_ollama import FakeOllamaServer  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+SPEAKERS = ("Alice", "Bob", "Claire", "David", "Emma", "François", "Gabrielle", "Hugo")
+MESSAGE = "Je ne suis pas sûr que ce soit une bonne idée, mais allons-y quand même."
+# Métriques comparées à la référence : nom -> True si une valeur plus haute est meilleure
+COMPARED_METRICS = {'p50_s': False, 'p95_s': False, 'ttft_p50_s': False, 'throughput': True, 'peak_mb': False}
+# Écarts absolus en dessous desquels une variation est considérée comme du bruit
+NOISE_FLOOR = {'p50_s': 0.002, 'p95_s': 0.005, 'ttft_p50_s': 0.002, 'throughput': 0.0, 'peak_mb': 1.0}
+
+
+def percentile(values, q):
+    """Percentile q (entre 0 et 1) par interpolation linéaire."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def measure(run, runs, setup=None, warmup=1):
+    """Exécute run() warmup + runs fois et retourne les durées mesurées (setup() n'est pas chronométré)."""
+    durations = []
+    for i in range(warmup + runs):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        if i >= warmup:
+            durations.append(elapsed)
+    return durations
+
+
+def peak_memory_mb(run, setup=None):
+    """Pic d'allocations Python (Mo) pendant une exécution de run()."""
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def make_result(name, durations, work_per_run, unit, peak_mb, **extra):
+    """Résultat d'un scénario : débit = unités de travail traitées par seconde."""
+    total = sum(durations)
+    result = {
+        'name': name, 'runs': len(durations),
+        'p50_s': percentile(durations, 0.5), 'p95_s': percentile(durations, 0.95),
+        'throughput': work_per_run * len(durations) / total if total > 0 else 0.0, 'unit': unit,
+        'peak_mb': peak_mb,
+    }
+    result.update(extra)
+    return result
+
+
+def write_dialogue(path, lines):
+    """Écrit un dialogue synthétique de lines répliques."""
+    block = 10000
+    with open(path, 'w', encoding='utf-8') as f:
+        for start in range(0, lines, block):
+            f.write("".join(f"{SPEAKERS[i % len(SPEAKERS)]}: {MESSAGE} ({i})\n" for i in range(start, min(start + block, lines))))
+    return str(path)
+
+
+def write_log_folder(folder, count):
+    """Crée count petits fichiers .txt (et quelques autres) aux dates de modification distinctes."""
+    os.makedirs(folder, exist_ok=True)
+    now = time.time()
+    for i in range(count):
+        path = os.path.join(folder, f"dialogue_{i:05d}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"Alice: Bonjour ({i})\nBob: Salut\n")
+        os.utime(path, (now - i, now - i))
+        if i % 10 == 0:
+            with open(os.path.join(folder, f"notes_{i:05d}.md"), 'w', encoding='utf-8') as f:
+                f.write("-\n")
+    return folder
+
+
+def _check(response):
+    """Les fonctions de génération retournent "Erreur: ..." au lieu de lever : une erreur invalide la mesure."""
+    text = response[0] if isinstance(response, tuple) else response
+    if text.startswith("Erreur"):
+        raise RuntimeError(text)
+
+
+def bench_generation(args, workdir):
+    """Chemins de génération contre le serveur simulé."""
+    results = []
+    server = FakeOllamaServer(models=[args.model], token_latency=args.token_latency,
+                              prompt_token_latency=args.prompt_token_latency, load_time=args.load_time,
+                              max_concurrency=args.max_concurrency).start()
+    try:
+        ollama_utils.configure_client_pool([{'url': server.url, 'weight': 1}])
+        dialogue = ollama_utils.get_dialogue(write_dialogue(Path(workdir) / "generation.txt", 2000))
+        options = {'temperature': 1.0, 'top_p': 0.9, 'max_tokens': args.tokens}
+        # Résumés désactivés : leurs appels en arrière-plan fausseraient les mesures
+        common = dict(options=options, summarize=False, keep_alive="10m")
+
+        def cold_start(run):
+            server.reset()
+            started = time.perf_counter()
+            run()
+            return time.perf_counter() - started
+
+        def single():
+            _check(ollama_utils.generate_dialogue_response(args.model, "Alice", dialogue, "Vous êtes Alice.", "Répondez.", **common))
+        cold = cold_start(single)
+        durations = measure(single, args.runs)
+        results.append(make_result("generate_dialogue_response", durations, args.tokens, "tokens/s",
+                                   peak_memory_mb(single), cold_s=cold))
+
+        first_tokens = []
+
+        def streamed():
+            started = time.perf_counter()
+            first = None
+            text = ""
+            for delta in ollama_utils.stream_dialogue_response(args.model, "Alice", dialogue, "Vous êtes Alice.", "Répondez.", **common):
+                if first is None:
+                    first = time.perf_counter() - started
+                text += delta
+            _check(text)
+            first_tokens.append(first or 0.0)
+        durations = measure(streamed, args.runs)
+        ttft = first_tokens[-args.runs:]  # sans l'appel de chauffe
+        results.append(make_result("stream_dialogue_response", durations, args.tokens, "tokens/s", peak_memory_mb(streamed),
+                                   ttft_p50_s=percentile(ttft, 0.5), ttft_p95_s=percentile(ttft, 0.95)))
+
+        def multiple():
+            for response in ollama_utils.generate_multiple_responses(args.model, "Alice", dialogue, "Vous êtes Alice.", "Répondez.",
+                                                                     num_responses=args.candidates, max_workers=args.candidates, **common):
+                _check(response)
+        server.reset()
+        durations = measure(multiple, args.runs)
+        results.append(make_result(f"generate_multiple_responses[k={args.candidates}]", durations, args.tokens * args.candidates,
+                                   "tokens/s", peak_memory_mb(multiple), server_max_active=server.max_active))
+    finally:
+        server.stop()
+        ollama_utils.configure_client_pool()
+    return results
+
+
+def bench_parsing(args, workdir):
+    """parse_dialogue et get_speakers à froid (cache de parsing vidé avant chaque mesure)."""
+    results = []
+    runs = max(1, args.runs // 4)
+    for lines in args.lines:
+        path = write_dialogue(Path(workdir) / f"dialogue_{lines}.txt", lines)
+
+        def cold():
+            ollama_utils.invalidate_dialogue_cache(path)
+        for name, run in (("parse_dialogue", lambda: ollama_utils.parse_dialogue(path)),
+                          ("get_speakers", lambda: ollama_utils.get_speakers(path))):
+            durations = measure(run, runs, setup=cold)
+            results.append(make_result(f"{name}[{lines}]", durations, lines, "lignes/s", peak_memory_mb(run, setup=cold)))
+        ollama_utils.invalidate_dialogue_cache(path)
+        os.remove(path)
+    return results
+
+
+def bench_listing(args, workdir):
+    """list_log_files sur un dossier de args.files fichiers, par parcours du disque puis depuis l'index."""
+    folder = write_log_folder(os.path.join(workdir, "logs"), args.files)
+    scan = lambda: ollama_utils.list_log_files(folder)  # noqa: E731
+    results = [make_result(f"list_log_files[{args.files}]", measure(scan, args.runs), args.files, "fichiers/s",
+                           peak_memory_mb(scan))]
+
+    index = ollama_utils.DialogueDirectoryIndex(polling=True, poll_interval=3600)
+    started = time.perf_counter()
+    index.watch(folder)
+    indexing = time.perf_counter() - started
+    indexed = lambda: index.files(folder)  # noqa: E731
+    results.append(make_result(f"list_log_files_indexed[{args.files}]", measure(indexed, args.runs), args.files, "fichiers/s",
+                               peak_memory_mb(indexed), index_build_s=indexing))
+    index.stop()
+    return results
+
+
+def bench_app(args, workdir):
+    """Un rerun complet d'app.py (streamlit.testing), le pool pointant sur le serveur simulé."""
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        print("  streamlit.testing indisponible : scénario app_rerun ignoré")
+        return []
+    root = Path(__file__).resolve().parent.parent
+    server = FakeOllamaServer(models=[args.model], token_latency=args.token_latency, max_concurrency=args.max_concurrency).start()
+    previous = os.getcwd()
+    try:
+        ollama_utils.configure_client_pool([{'url': server.url, 'weight': 1}])
+        os.chdir(root)
+        app = AppTest.from_file(str(root / "app.py"), default_timeout=60)
+
+        def rerun():
+            app.run()
+            if app.exception:
+                raise RuntimeError(app.exception[0].message)
+        durations = measure(rerun, args.runs)
+        results = [make_result("app_rerun", durations, 1, "reruns/s", peak_memory_mb(rerun))]
+    finally:
+        os.chdir(previous)
+        server.stop()
+        ollama_utils.configure_client_pool()
+    return results
+
+
+SCENARIOS = {
+    'generation': bench_generation,
+    'parse_dialogue': bench_parsing,
+    'list_log_files': bench_listing,
+    'app': bench_app,
+}
+
+
+def compare(results, baseline, threshold):
+    """Retourne les régressions : (scénario, métrique, référence, valeur, variation relative)."""
+    regressions = []
+    reference = {result['name']: result for result in baseline.get('results', [])}
+    for result in results:
+        base = reference.get(result['name'])
+        if base is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if metric not in result or not base.get(metric):
+                continue
+            before, after = base[metric], result[metric]
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            if worse > threshold and abs(after - before) > NOISE_FLOOR[metric]:
+                regressions.append((result['name'], metric, before, after, change))
+    return regressions
+
+
+def print_results(results, baseline):
+    reference = {result['name']: result for result in baseline.get('results', [])}
+    print(f"\n{'scénario':<42} {'p50':>10} {'p95':>10} {'débit':>22} {'pic mém.':>10} {'vs réf. p50':>12}")
+    for result in results:
+        base = reference.get(result['name'])
+        delta = f"{100 * (result['p50_s'] / base['p50_s'] - 1):+.1f} %" if base and base.get('p50_s') else "-"
+        throughput = f"{result['throughput']:.1f} {result['unit']}"
+        print(f"{result['name']:<42} {result['p50_s'] * 1000:>8.1f}ms {result['p95_s'] * 1000:>8.1f}ms "
+              f"{throughput:>22} {result['peak_mb']:>8.1f}Mo {delta:>12}")
+        extras = {key: value for key, value in result.items() if key in ('cold_s', 'ttft_p50_s', 'ttft_p95_s', 'index_build_s', 'server_max_active')}
+        if extras:
+            print("    " + ", ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}" for key, value in extras.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=sorted(SCENARIOS), help="Scénarios à exécuter (par défaut : tous)")
+    parser.add_argument("--quick", action="store_true", help="Tailles réduites pour une vérification rapide")
+    parser.add_argument("--runs", type=int, default=20, help="Mesures par scénario")
+    parser.add_argument("--lines", type=int, nargs="+", help="Tailles de dialogue (par défaut : 10000 100000 1000000)")
+    parser.add_argument("--files", type=int, help="Fichiers du dossier de listage (par défaut : 10000)")
+    parser.add_argument("--model", default="fake:latest", help="Nom du modèle simulé")
+    parser.add_argument("--tokens", type=int, default=32, help="Tokens générés par réponse")
+    parser.add_argument("--candidates", type=int, default=3, help="Réponses candidates de generate_multiple_responses")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Secondes par token généré (serveur simulé)")
+    parser.add_argument("--prompt-token-latency", type=float, default=0.0, help="Secondes par token de prompt (serveur simulé)")
+    parser.add_argument("--load-time", type=float, default=0.5, help="Chargement du modèle au premier appel (serveur simulé)")
+    parser.add_argument("--max-concurrency", type=int, default=2, help="Requêtes traitées en parallèle (serveur simulé)")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="Fichier de référence")
+    parser.add_argument("--save-baseline", action="store_true", help="Enregistre les résultats comme nouvelle référence")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Dégradation relative tolérée avant de signaler une régression")
+    parser.add_argument("--output", type=Path, help="Écrit aussi les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.runs = min(args.runs, 5)
+    args.lines = args.lines or ([10000, 100000] if args.quick else [10000, 100000, 1000000])
+    args.files = args.files or (1000 if args.quick else 10000)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        for name in args.only or SCENARIOS:
+            print(f"[{name}]")
+            results.extend(SCENARIOS[name](args, workdir))
+
+    baseline = json.loads(args.baseline.read_text(encoding='utf-8')) if args.baseline.exists() else {}
+    print_results(results, baseline)
+    report = {'created': time.strftime("%Y-%m-%dT%H:%M:%S"), 'python': sys.version.split()[0], 'results': results}
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+        print(f"\nRéférence enregistrée dans {args.baseline}")
+        return
+    if not baseline:
+        print(f"\nAucune référence ({args.baseline}) : lancez avec --save-baseline pour en créer une.")
+        return
+    regressions = compare(results, baseline, args.threshold)
+    if not regressions:
+        print(f"\nAucune régression au-delà de {100 * args.threshold:.0f} %.")
+        return
+    print(f"\n⚠️ {len(regressions)} régression(s) au-delà de {100 * args.threshold:.0f} % :")
+    for name, metric, before, after, change in regressions:
+        print(f"  {name} — {metric} : {before:.4g} → {after:.4g} ({100 * change:+.1f} %)")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Serveur local qui imite l'API d'Ollama, pour mesurer sans GPU.
+
+Implémente /api/chat (avec et sans streaming), /api/tags, /api/ps et
+/api/version. Les temps sont simulés : chargement du modèle au premier appel
+(load_time), évaluation du prompt (prompt_token_latency par token) puis
+génération (token_latency par token). Au-delà de max_concurrency requêtes
+simultanées, les suivantes attendent leur tour, comme avec OLLAMA_NUM_PARALLEL.
+
+Usage :
+    python benchmarks/fake_ollama.py --port 11434 --token-latency 0.02 --load-time 2 --max-concurrency 2
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import threading
+import time
+
+DEFAULT_MODELS = ("fake:latest",)
+DEFAULT_NUM_PREDICT = 32
+WORDS = ("bien", "sûr", "je", "pense", "que", "nous", "devrions", "partir", "maintenant", "vraiment")
+
+
+def _nanoseconds(seconds):
+    return int(seconds * 1e9)
+
+
+class FakeOllamaServer:
+    """Serveur Ollama simulé, démarré dans un thread (port 0 : port libre choisi par le système)."""
+
+    def __init__(self, host="127.0.0.1", port=0, models=DEFAULT_MODELS, token_latency=0.01, prompt_token_latency=0.0,
+                 load_time=0.0, max_concurrency=1, num_predict=DEFAULT_NUM_PREDICT):
+        self.models = list(models)
+        self.token_latency = token_latency
+        self.prompt_token_latency = prompt_token_latency
+        self.load_time = load_time
+        self.num_predict = num_predict
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._loaded = set()
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.max_active = 0
+        self._active = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset(self):
+        """Décharge les modèles et remet les compteurs à zéro."""
+        with self._load_lock:
+            self._loaded.clear()
+        with self._stats_lock:
+            self.requests = 0
+            self.max_active = 0
+
+    def _load(self, model):
+        """Simule le chargement du modèle ; retourne la durée de chargement (0 s'il était déjà chargé)."""
+        with self._load_lock:
+            if model in self._loaded:
+                return 0.0
+            time.sleep(self.load_time)
+            self._loaded.add(model)
+            return self.load_time
+
+    def _generate(self, body):
+        """Prépare une réponse : (durées, liste des tokens à émettre avec leur délai)."""
+        model = body.get('model', '')
+        messages = body.get('messages') or []
+        options = body.get('options') or {}
+        load_duration = self._load(model)
+        if not messages:
+            return {'load_duration': load_duration, 'prompt_eval_count': 0, 'prompt_eval_duration': 0.0}, []
+        prompt_tokens = sum(len(str(message.get('content', ''))) for message in messages) // 4 + 1
+        time.sleep(prompt_tokens * self.prompt_token_latency)
+        count = options.get('num_predict') or options.get('max_tokens') or self.num_predict
+        seed = options.get('seed') or 0
+        tokens = [("" if i == 0 else " ") + WORDS[(seed + i) % len(WORDS)] for i in range(max(1, int(count)))]
+        timings = {'load_duration': load_duration, 'prompt_eval_count': prompt_tokens,
+                   'prompt_eval_duration': prompt_tokens * self.prompt_token_latency}
+        if body.get('keep_alive') in (0, "0", "0s"):
+            with self._load_lock:
+                self._loaded.discard(model)
+        return timings, tokens
+
+    def _done_fields(self, model, timings, tokens, started):
+        eval_duration = len(tokens) * self.token_latency
+        return {
+            'model': model, 'created_at': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), 'done': True, 'done_reason': 'stop',
+            'total_duration': _nanoseconds(time.perf_counter() - started), 'load_duration': _nanoseconds(timings['load_duration']),
+            'prompt_eval_count': timings['prompt_eval_count'], 'prompt_eval_duration': _nanoseconds(timings['prompt_eval_duration']),
+            'eval_count': len(tokens), 'eval_duration': _nanoseconds(eval_duration),
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, payload, status=200):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_chunk(self, payload):
+                line = (json.dumps(payload) + "\n").encode('utf-8')
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path == '/api/tags':
+                    self._send_json({'models': [{'name': name, 'model': name, 'size': 0, 'digest': '', 'details': {}}
+                                                for name in server.models]})
+                elif self.path == '/api/ps':
+                    with server._load_lock:
+                        loaded = sorted(server._loaded)
+                    self._send_json({'models': [{'name': name, 'model': name, 'size': 0, 'size_vram': 0} for name in loaded]})
+                elif self.path == '/api/version':
+                    self._send_json({'version': '0.0.0-fake'})
+                else:
+                    self._send_json({'error': 'not found'}, 404)
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if self.path != '/api/chat':
+                    self._send_json({'error': 'not found'}, 404)
+                    return
+                model = body.get('model', '')
+                if model not in server.models:
+                    self._send_json({'error': f"model '{model}' not found"}, 404)
+                    return
+                with server._slots:
+                    with server._stats_lock:
+                        server.requests += 1
+                        server._active += 1
+                        server.max_active = max(server.max_active, server._active)
+                    try:
+                        self._chat(body, model)
+                    finally:
+                        with server._stats_lock:
+                            server._active -= 1
+
+            def _chat(self, body, model):
+                started = time.perf_counter()
+                timings, tokens = server._generate(body)
+                if body.get('stream', True):
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/x-ndjson')
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.end_headers()
+                    for token in tokens:
+                        time.sleep(server.token_latency)
+                        self._send_chunk({'model': model, 'message': {'role': 'assistant', 'content': token}, 'done': False})
+                    final = server._done_fields(model, timings, tokens, started)
+                    final['message'] = {'role': 'assistant', 'content': ''}
+                    self._send_chunk(final)
+                    self.wfile.write(b"0\r\n\r\n")
+                else:
+                    time.sleep(len(tokens) * server.token_latency)
+                    response = server._done_fields(model, timings, tokens, started)
+                    response['message'] = {'role': 'assistant', 'content': "".join(tokens)}
+                    self._send_json(response)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--models", nargs="+", default=list(DEFAULT_MODELS), help="Modèles annoncés par /api/tags")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Secondes par token généré")
+    parser.add_argument("--prompt-token-latency", type=float, default=0.0, help="Secondes par token de prompt évalué")
+    parser.add_argument("--load-time", type=float, default=0.0, help="Secondes de chargement au premier appel d'un modèle")
+    parser.add_argument("--max-concurrency", type=int, default=1, help="Requêtes traitées en parallèle")
+    parser.add_argument("--num-predict", type=int, default=DEFAULT_NUM_PREDICT, help="Tokens générés quand la requête n'en fixe pas")
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(args.host, args.port, args.models, args.token_latency, args.prompt_token_latency,
+                              args.load_time, args.max_concurrency, args.num_predict)
+    print(f"Serveur Ollama simulé sur {server.url} (Ctrl+C pour arrêter)")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,334 @@
-from ollama import list as get_models, chat
+from ollama import Client, ResponseError
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+import threading
+import hashlib
+import httpx
+import json
+import logging
+import sqlite3
 import os
 import toml
 import random
 import time
 import uuid
 import re
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
 
-def clean_response(response_text, character_name):
-    """Nettoie la réponse pour enlever le nom du personnage et les guillemets."""
-    # Enlever le nom du personnage au début
-    patterns_to_remove = [
+logger = logging.getLogger(__name__)
+
+# Génération concurrente : nombre maximal de requêtes simultanées vers Ollama
+# (à aligner sur OLLAMA_NUM_PARALLEL) et délai maximal par requête, en secondes.
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_REQUEST_TIMEOUT = 120
+
+# Disposition des prompts : "stable" garde un préfixe identique d'une génération
+# à l'autre (Ollama réutilise alors le prompt déjà évalué) et place les parties
+# variables en fin de message ; "legacy" reproduit l'ancienne disposition avec
+# identifiant unique, qui force une réévaluation complète à chaque appel.
+PROMPT_LAYOUTS = ("stable", "legacy")
+DEFAULT_PROMPT_LAYOUT = "stable"
+
+# Mode déterministe : graine de base (décalée par variante) et pas de variation de température,
+# pour pouvoir reproduire un lot de réponses et le resservir depuis le cache.
+DETERMINISTIC_SEED = 42
+
+RANDOM_INSTRUCTIONS = [
+    "Réponds de manière naturelle et immersive.",
+    "Continue l'histoire de façon engageante.",
+    "Réagis comme le personnage le ferait.",
+    "Apporte de la tension ou de l'humour.",
+    "Développe la réponse de manière détaillée.",
+    "Sois créatif dans ta réponse."
+]
+
+# Pool de clients Ollama : hôtes et poids lus dans la section [ollama] de config.toml.
+DEFAULT_HEALTH_INTERVAL = 15
+DEFAULT_HEALTH_TIMEOUT = 3
+DEFAULT_MAX_CONNECTIONS = 8
+
+class _OllamaHost:
+    """État d'un hôte Ollama du pool : charge en cours, santé et clients HTTP persistants."""
+
+    def __init__(self, url, weight=1.0, max_connections=DEFAULT_MAX_CONNECTIONS):
+        self.url = url
+        self.weight = max(float(weight), 0.01)
+        self.max_connections = max_connections
+        self.in_flight = 0
+        self.served = 0
+        self.failures = 0
+        self.healthy = True
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
+    def client(self, timeout=None):
+        """Client (et donc connexions HTTP keep-alive) réutilisé pour ce délai."""
+        with self._clients_lock:
+            client = self._clients.get(timeout)
+            if client is None:
+                limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+                client = Client(host=self.url, timeout=timeout, limits=limits)
+                self._clients[timeout] = client
+            return client
+
+    def load(self):
+        return (self.in_flight + 1) / self.weight, self.served / self.weight
+
+class OllamaClientPool:
+    """Pool de clients Ollama répartis sur plusieurs hôtes.
+
+    Chaque requête est envoyée à l'hôte sain le moins chargé (requêtes en
+    cours rapportées au poids). Si l'hôte échoue, la requête est relancée
+    sur un autre hôte et l'hôte fautif est marqué indisponible jusqu'à ce
+    qu'un contrôle de santé périodique le déclare rétabli. Les clients HTTP
+    sont conservés par hôte pour réutiliser les connexions.
+    """
+
+    def __init__(self, hosts=None, health_interval=DEFAULT_HEALTH_INTERVAL, health_timeout=DEFAULT_HEALTH_TIMEOUT, max_connections=DEFAULT_MAX_CONNECTIONS):
+        hosts = hosts or [{'url': None}]  # None : hôte par défaut d'ollama (OLLAMA_HOST)
+        self.hosts = [_OllamaHost(host.get('url'), host.get('weight', 1.0), max_connections) for host in hosts]
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread = None
+        if health_interval and len(self.hosts) > 1:
+            self._health_thread = threading.Thread(target=self._health_loop, name="ollama-health", daemon=True)
+            self._health_thread.start()
+
+    def _acquire(self, excluded):
+        with self._lock:
+            candidates = [host for host in self.hosts if host not in excluded]
+            if not candidates:
+                return None
+            # Si aucun hôte n'est déclaré sain, on tente quand même les autres
+            healthy = [host for host in candidates if host.healthy] or candidates
+            host = min(healthy, key=_OllamaHost.load)
+            host.in_flight += 1
+            host.served += 1
+            return host
+
+    def _release(self, host, error=None):
+        with self._lock:
+            host.in_flight -= 1
+            if error is None:
+                host.healthy = True
+            elif self._is_host_failure(error):
+                host.failures += 1
+                host.healthy = False
+
+    @staticmethod
+    def _is_host_failure(error):
+        """Erreur de transport imputable à l'hôte : connexion refusée, coupée, ou délai de connexion dépassé.
+
+        Un délai de lecture dépassé n'en fait pas partie : sur une longue
+        génération, l'hôte est lent mais joignable, et relancer la requête
+        ailleurs doublerait le travail. Les erreurs côté client (options
+        invalides...) ne concernent aucun hôte.
+        """
+        if isinstance(error, httpx.TimeoutException):
+            return isinstance(error, httpx.ConnectTimeout)
+        return isinstance(error, (ConnectionError, httpx.TransportError))
+
+    @classmethod
+    def _should_retry(cls, error):
+        if isinstance(error, ResponseError):
+            # 404 : modèle absent de cet hôte ; 5xx : erreur du serveur
+            return error.status_code == 404 or error.status_code >= 500
+        return cls._is_host_failure(error)
+
+    @staticmethod
+    def _final_error(errors):
+        """Erreur à remonter après bascule : une réponse d'Ollama (ex. modèle absent) plutôt qu'un hôte injoignable."""
+        for error in reversed(errors):
+            if isinstance(error, ResponseError):
+                return error
+        return errors[-1]
+
+    def _call(self, method, timeout=None, **kwargs):
+        if kwargs.get('stream'):
+            return self._stream(method, timeout, kwargs)
+        tried = []
+        errors = []
+        while True:
+            host = self._acquire(tried)
+            if host is None:
+                raise self._final_error(errors)
+            tried.append(host)
+            try:
+                result = getattr(host.client(timeout), method)(**kwargs)
+            except Exception as e:
+                self._release(host, e)
+                errors.append(e)
+                if not self._should_retry(e):
+                    raise
+                continue
+            self._release(host)
+            return result
+
+    def _stream(self, method, timeout, kwargs):
+        """Relaie un flux ; bascule sur un autre hôte si l'échec survient avant le premier fragment.
+
+        L'hôte n'est réservé qu'au début de la lecture du flux et il est libéré
+        quoi qu'il arrive : fin normale, erreur ou fermeture anticipée par
+        l'appelant (GeneratorExit, par exemple quand Streamlit interrompt le script).
+        """
+        tried = []
+        errors = []
+        while True:
+            host = self._acquire(tried)
+            if host is None:
+                raise self._final_error(errors)
+            tried.append(host)
+            started = False
+            error = None
+            try:
+                for chunk in getattr(host.client(timeout), method)(**kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                error = e
+            finally:
+                self._release(host, error)
+            if error is None:
+                return
+            errors.append(error)
+            if started or not self._should_retry(error):
+                raise error
+
+    def chat(self, timeout=None, **kwargs):
+        """Équivalent de ollama.chat, routé vers l'hôte le moins chargé avec bascule."""
+        return self._call('chat', timeout, **kwargs)
+
+    def list(self, timeout=None):
+        """Équivalent de ollama.list (premier hôte disponible)."""
+        return self._call('list', timeout)
+
+    def ps(self, timeout=None):
+        """Modèles chargés sur l'ensemble des hôtes sains (réponse de /api/ps fusionnée)."""
+        models = []
+        errors = []
+        for host in self.healthy_hosts():
+            try:
+                models.extend(host.client(timeout).ps()['models'])
+            except Exception as e:
+                errors.append(e)
+        if errors and not models:
+            raise errors[0]
+        return {'models': models}
+
+    def healthy_hosts(self):
+        """Hôtes actuellement considérés comme sains."""
+        with self._lock:
+            return [host for host in self.hosts if host.healthy]
+
+    def bind(self, timeout):
+        """Vue du pool dont les requêtes utilisent le délai donné."""
+        return _BoundPool(self, timeout)
+
+    def check_health(self):
+        """Interroge chaque hôte (/api/version) et met à jour son état de santé."""
+        for host in self.hosts:
+            try:
+                host.client(self.health_timeout)._client.get('/api/version').raise_for_status()
+                healthy = True
+            except Exception:
+                healthy = False
+            with self._lock:
+                host.healthy = healthy
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def stats(self):
+        """État de chaque hôte : url, poids, santé, requêtes en cours, servies et échecs."""
+        with self._lock:
+            return [{'url': host.url, 'weight': host.weight, 'healthy': host.healthy, 'in_flight': host.in_flight,
+                     'served': host.served, 'failures': host.failures} for host in self.hosts]
+
+    def close(self):
+        """Arrête les contrôles de santé et ferme les connexions."""
+        self._stop.set()
+        for host in self.hosts:
+            for client in host._clients.values():
+                client._client.close()
+            host._clients.clear()
+
+class _BoundPool:
+    """Pool vu avec un délai par requête fixé (utilisé par les générations parallèles)."""
+
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+
+    def chat(self, **kwargs):
+        return self.pool.chat(self.timeout, **kwargs)
+
+_client_pool = None
+_client_pool_lock = threading.Lock()
+
+def load_config():
+    """Charge config.toml depuis le dossier du projet."""
+    config_path = Path(__file__).parent / "config.toml"
+    if config_path.exists():
+        return toml.load(config_path)
+    return {}
+
+def configure_client_pool(hosts=None, health_interval=DEFAULT_HEALTH_INTERVAL, health_timeout=DEFAULT_HEALTH_TIMEOUT, max_connections=DEFAULT_MAX_CONNECTIONS):
+    """Remplace le pool de clients partagé (hosts : liste de {'url': ..., 'weight': ...})."""
+    global _client_pool
+    with _client_pool_lock:
+        if _client_pool is not None:
+            _client_pool.close()
+        _client_pool = OllamaClientPool(hosts, health_interval, health_timeout, max_connections)
+        return _client_pool
+
+def get_client_pool():
+    """Retourne le pool de clients partagé, créé à la demande depuis la section [ollama] de config.toml."""
+    global _client_pool
+    with _client_pool_lock:
+        if _client_pool is None:
+            ollama_config = load_config().get("ollama", {})
+            _client_pool = OllamaClientPool(
+                ollama_config.get("hosts"),
+                ollama_config.get("health_interval", DEFAULT_HEALTH_INTERVAL),
+                ollama_config.get("health_timeout", DEFAULT_HEALTH_TIMEOUT),
+                ollama_config.get("max_connections", DEFAULT_MAX_CONNECTIONS),
+            )
+        return _client_pool
+
+def chat(**kwargs):
+    """Équivalent de ollama.chat passant par le pool de clients."""
+    return get_client_pool().chat(**kwargs)
+
+def get_models():
+    """Équivalent de ollama.list passant par le pool de clients."""
+    return get_client_pool().list()
+
+def get_running_models():
+    """Équivalent de ollama.ps sur l'ensemble des hôtes du pool."""
+    return get_client_pool().ps()
+
+def _name_prefix_patterns(character_name):
+    """Motifs du nom du personnage à retirer en début de réponse."""
+    return [
         f"^{character_name}\\s*:\\s*",  # "Enseignant: "
         f"^{character_name}\\s+",       # "Enseignant "
         f"^\\*\\*{character_name}\\*\\*\\s*:\\s*",  # "**Enseignant**: "
     ]
+
+def clean_response(response_text, character_name):
+    """Nettoie la réponse pour enlever le nom du personnage et les guillemets."""
+    # Enlever le nom du personnage au début
+    patterns_to_remove = _name_prefix_patterns(character_name)
     
     cleaned = response_text.strip()
     
@@ -30,20 +344,109 @@ def clean_response(response_text, character_name):
     
     return cleaned.strip()
 
-def get_available_models():
-    """Retourne la liste des modèles Ollama disponibles."""
+# Catalogue des modèles : servi depuis la mémoire pendant MODEL_CATALOG_TTL secondes,
+# puis rafraîchi en arrière-plan (la liste précédente reste servie entre-temps).
+MODEL_CATALOG_TTL = 30
+DEFAULT_MODELS = ["llama2-uncensored:latest"]
+
+_model_catalog = {'models': None, 'fetched_at': 0.0, 'refreshing': False}
+_model_states = {}  # modèle -> "cold" | "loading" | "warm" | "error"
+_model_lock = threading.Lock()
+
+def _fetch_models():
+    """Interroge Ollama et retourne la liste des modèles disponibles (lève en cas d'erreur)."""
+    models = get_models()
+    # Gérer le cas où models est un objet avec attribut models ou un dictionnaire
+    if hasattr(models, 'models'):
+        return [model.model for model in models.models]
+    elif isinstance(models, dict) and 'models' in models:
+        return [model['model'] if isinstance(model, dict) else model.model for model in models['models']]
+    else:
+        return list(DEFAULT_MODELS)  # Modèle par défaut
+
+def _sync_model_states():
+    """Aligne l'état des modèles sur ceux réellement chargés par Ollama (/api/ps)."""
     try:
-        models = get_models()
-        # Gérer le cas où models est un objet avec attribut models ou un dictionnaire
-        if hasattr(models, 'models'):
-            return [model.model for model in models.models]
-        elif isinstance(models, dict) and 'models' in models:
-            return [model['model'] if isinstance(model, dict) else model.model for model in models['models']]
-        else:
-            return ["llama2-uncensored:latest"]  # Modèle par défaut
+        running = get_running_models()
+        loaded = {model.model if hasattr(model, 'model') else model['model'] for model in running['models']}
+    except Exception:
+        return
+    with _model_lock:
+        for model_name in loaded:
+            _model_states[model_name] = "warm"
+        for model_name, state in list(_model_states.items()):
+            # Un modèle déchargé (keep_alive écoulé) redevient froid
+            if state == "warm" and model_name not in loaded:
+                _model_states[model_name] = "cold"
+
+def _refresh_model_catalog():
+    try:
+        models = _fetch_models()
+        with _model_lock:
+            _model_catalog['models'] = models
+            _model_catalog['fetched_at'] = time.monotonic()
+        _sync_model_states()
     except Exception as e:
-        print(f"Erreur de connexion à Ollama: {e}")
-        return ["llama2-uncensored:latest"]  # Modèle par défaut si Ollama n'est pas disponible
+        logger.warning("Erreur de connexion à Ollama: %s", e)
+    finally:
+        with _model_lock:
+            _model_catalog['refreshing'] = False
+
+def get_available_models(ttl=MODEL_CATALOG_TTL):
+    """Retourne la liste des modèles Ollama disponibles.
+
+    La liste est mise en cache ttl secondes ; au-delà, elle est rafraîchie
+    dans un thread d'arrière-plan et la liste précédente est retournée.
+    """
+    with _model_lock:
+        models = _model_catalog['models']
+        stale = time.monotonic() - _model_catalog['fetched_at'] > ttl
+        refresh_in_background = models is not None and stale and not _model_catalog['refreshing']
+        if refresh_in_background:
+            _model_catalog['refreshing'] = True
+    if models is None:
+        # Premier appel : pas encore de liste à servir, on attend la réponse
+        try:
+            models = _fetch_models()
+        except Exception as e:
+            logger.warning("Erreur de connexion à Ollama: %s", e)
+            return list(DEFAULT_MODELS)  # Modèle par défaut si Ollama n'est pas disponible
+        with _model_lock:
+            _model_catalog['models'] = models
+            _model_catalog['fetched_at'] = time.monotonic()
+        threading.Thread(target=_sync_model_states, name="ollama-model-states", daemon=True).start()
+    elif refresh_in_background:
+        threading.Thread(target=_refresh_model_catalog, name="ollama-model-catalog", daemon=True).start()
+    return list(models)
+
+def get_model_state(model_name):
+    """Retourne l'état de chargement du modèle : "cold", "loading", "warm" ou "error"."""
+    with _model_lock:
+        return _model_states.get(model_name, "cold")
+
+def _warm_up(model_name, keep_alive):
+    try:
+        # Une requête sans message charge le modèle en mémoire sans rien générer,
+        # sur chaque hôte sain puisque les requêtes peuvent être routées vers n'importe lequel
+        for host in get_client_pool().healthy_hosts() or get_client_pool().hosts:
+            host.client().chat(model=model_name, messages=[], keep_alive=keep_alive)
+        state = "warm"
+    except Exception as e:
+        logger.warning("Préchargement du modèle %s impossible: %s", model_name, e)
+        state = "error"
+    with _model_lock:
+        _model_states[model_name] = state
+
+def warm_up_model(model_name, keep_alive=None):
+    """Précharge le modèle en arrière-plan pour que la première génération ne paie pas le chargement.
+
+    Sans effet si le modèle est déjà chargé ou en cours de chargement.
+    """
+    with _model_lock:
+        if _model_states.get(model_name) in ("loading", "warm"):
+            return
+        _model_states[model_name] = "loading"
+    threading.Thread(target=_warm_up, args=(model_name, keep_alive), name="ollama-warm-up", daemon=True).start()
 
 def load_prompts():
     """Charge les prompts depuis prompts.toml."""
@@ -52,7 +455,327 @@ def load_prompts():
         return toml.load(prompts_path)
     return {"system_prompts": {}, "user_prompts": {}}
 
-def get_chat_response(model_name, user_message, system_prompt="", user_prompt="", options=None):
+# Métriques par appel : champs de durée/tokens renvoyés par Ollama (en nanosecondes
+# pour les durées) et temps mesuré côté client, étiquetés par modèle, personnage
+# et point d'entrée.
+METRIC_FIELDS = ("total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration")
+METRIC_QUANTILES = (0.5, 0.95, 0.99)
+
+def _quantile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class MetricsRecorder:
+    """Enregistre les métriques de chaque appel à Ollama.
+
+    Les derniers window échantillons de chaque combinaison (modèle, point
+    d'entrée, personnage) sont gardés en mémoire pour calculer des centiles
+    glissants. Chaque échantillon peut aussi être ajouté à un journal JSONL,
+    et l'ensemble exporté au format texte Prometheus dans un fichier.
+    """
+
+    def __init__(self, window=500, jsonl_path=None, prometheus_path=None, prometheus_interval=10):
+        self.window = window
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.prometheus_interval = prometheus_interval
+        self._samples = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+        self._last_export = 0.0
+
+    def record(self, entry_point, model_name, wall_time, response=None, character=None, cached=False, error=None):
+        """Enregistre un appel ; response est la réponse Ollama (ou le dernier fragment d'un flux)."""
+        sample = {'timestamp': time.time(), 'entry_point': entry_point, 'model': model_name, 'character': character or "",
+                  'wall_time': wall_time, 'cached': cached, 'error': str(error) if error else None}
+        for field in METRIC_FIELDS:
+            sample[field] = (response.get(field) if response is not None else None) or 0
+        key = (model_name, entry_point, sample['character'])
+        with self._lock:
+            window = self._samples.get(key)
+            if window is None:
+                window = self._samples[key] = deque(maxlen=self.window)
+            window.append(sample)
+            totals = self._totals.setdefault(key, {'calls': 0, 'errors': 0, 'cached': 0, 'wall_time': 0.0, 'prompt_eval_count': 0, 'eval_count': 0})
+            totals['calls'] += 1
+            totals['errors'] += 1 if error else 0
+            totals['cached'] += 1 if cached else 0
+            totals['wall_time'] += wall_time
+            totals['prompt_eval_count'] += sample['prompt_eval_count']
+            totals['eval_count'] += sample['eval_count']
+            if self.jsonl_path:
+                with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(sample, ensure_ascii=False) + "\n")
+            export = self.prometheus_path and time.monotonic() - self._last_export >= self.prometheus_interval
+            if export:
+                self._last_export = time.monotonic()
+        logger.debug("Appel Ollama %s", sample)
+        if export:
+            self.export_prometheus()
+
+    def summary(self):
+        """Résumé par (modèle, point d'entrée, personnage) : appels, centiles de latence, débit."""
+        with self._lock:
+            items = [(key, list(window), dict(self._totals[key])) for key, window in self._samples.items()]
+        rows = []
+        for (model_name, entry_point, character), samples, totals in sorted(items):
+            live = [sample for sample in samples if not sample['cached'] and not sample['error']]
+            wall = sorted(sample['wall_time'] for sample in samples)
+            load = sorted(sample['load_duration'] / 1e9 for sample in live)
+            prompt_eval = sorted(sample['prompt_eval_duration'] / 1e9 for sample in live)
+            speed = sorted(sample['eval_count'] / (sample['eval_duration'] / 1e9) for sample in live if sample['eval_duration'])
+            rows.append({
+                'model': model_name, 'entry_point': entry_point, 'character': character,
+                'calls': totals['calls'], 'errors': totals['errors'], 'cached': totals['cached'],
+                'wall_p50_s': _quantile(wall, 0.5), 'wall_p95_s': _quantile(wall, 0.95),
+                'load_p50_s': _quantile(load, 0.5), 'prompt_eval_p50_s': _quantile(prompt_eval, 0.5),
+                'tokens_per_s_p50': _quantile(speed, 0.5),
+                'prompt_tokens': totals['prompt_eval_count'], 'generated_tokens': totals['eval_count'],
+            })
+        return rows
+
+    def to_prometheus(self):
+        """Retourne les métriques au format texte d'exposition Prometheus."""
+        with self._lock:
+            items = [(key, list(window), dict(self._totals[key])) for key, window in self._samples.items()]
+        lines = [
+            "# HELP ollama_call_wall_seconds Temps d'appel mesuré côté client (fenêtre glissante).",
+            "# TYPE ollama_call_wall_seconds summary",
+        ]
+        counters = []
+        for (model_name, entry_point, character), samples, totals in sorted(items):
+            labels = f'model="{_prometheus_escape(model_name)}",entry_point="{entry_point}",character="{_prometheus_escape(character)}"'
+            wall = sorted(sample['wall_time'] for sample in samples)
+            for q in METRIC_QUANTILES:
+                lines.append(f'ollama_call_wall_seconds{{{labels},quantile="{q}"}} {_quantile(wall, q):.6f}')
+            lines.append(f"ollama_call_wall_seconds_sum{{{labels}}} {totals['wall_time']:.6f}")
+            lines.append(f"ollama_call_wall_seconds_count{{{labels}}} {totals['calls']}")
+            counters.append((labels, totals))
+        for name, field, help_text in (
+            ("ollama_call_errors_total", 'errors', "Appels en erreur."),
+            ("ollama_call_cache_hits_total", 'cached', "Appels servis par le cache de réponses."),
+            ("ollama_prompt_eval_tokens_total", 'prompt_eval_count', "Tokens de prompt évalués."),
+            ("ollama_eval_tokens_total", 'eval_count', "Tokens générés."),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{{{labels}}} {totals[field]}" for labels, totals in counters)
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self, path=None):
+        """Écrit les métriques Prometheus dans un fichier (remplacement atomique)."""
+        path = path or self.prometheus_path
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def reset(self):
+        """Oublie tous les échantillons et compteurs."""
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+
+def _prometheus_escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+_metrics = MetricsRecorder()
+
+def configure_metrics(window=500, jsonl_path=None, prometheus_path=None, prometheus_interval=10):
+    """Remplace l'enregistreur de métriques partagé (et ses exports optionnels)."""
+    global _metrics
+    current = _metrics
+    if (current.window, current.jsonl_path, current.prometheus_path, current.prometheus_interval) != (window, jsonl_path, prometheus_path, prometheus_interval):
+        _metrics = MetricsRecorder(window, jsonl_path, prometheus_path, prometheus_interval)
+    return _metrics
+
+def get_metrics():
+    """Retourne l'enregistreur de métriques partagé."""
+    return _metrics
+
+_metrics_server = None
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Expose les métriques Prometheus sur http://host:port/metrics (une seule fois par processus)."""
+    global _metrics_server
+    if _metrics_server is not None:
+        return _metrics_server
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = _metrics.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("Serveur de métriques : " + format, *args)
+
+    _metrics_server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _metrics_server
+
+class ResponseCache:
+    """Cache des réponses d'Ollama : LRU en mémoire doublé d'un stockage SQLite borné.
+
+    Les clés sont des empreintes (voir make_cache_key) du modèle, des messages
+    et des options envoyés. Le stockage sur disque survit aux redémarrages ;
+    quand il dépasse max_db_bytes, les entrées les moins récemment lues sont
+    supprimées.
+    """
+
+    def __init__(self, max_entries=256, db_path=None, max_db_bytes=50 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.max_db_bytes = max_db_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_bytes = 0
+        if db_path:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._db.commit()
+            self._db_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @property
+    def stats(self):
+        """Compteurs du cache : hits, misses, entrées en mémoire et taille sur disque."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._memory), 'disk_bytes': self._db_bytes}
+
+    def get(self, key):
+        """Retourne la réponse en cache pour key, ou None."""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = row[0]
+                    self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    self._remember(key, value)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Enregistre la réponse value pour key en mémoire et sur disque."""
+        with self._lock:
+            self._remember(key, value)
+            if self._db is None:
+                return
+            size = len(value.encode('utf-8')) + len(key)
+            if size > self.max_db_bytes:
+                return
+            previous = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO responses (key, value, size, accessed) VALUES (?, ?, ?, ?)", (key, value, size, time.time()))
+            self._db_bytes += size - (previous[0] if previous else 0)
+            # Éviction des entrées les moins récemment lues au-delà de la taille maximale
+            while self._db_bytes > self.max_db_bytes:
+                oldest = self._db.execute("SELECT key, size FROM responses ORDER BY accessed LIMIT 64").fetchall()
+                for old_key, old_size in oldest:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                    self._db_bytes -= old_size
+                    if self._db_bytes <= self.max_db_bytes:
+                        break
+            self._db.commit()
+
+    def clear(self):
+        """Vide le cache en mémoire et sur disque, et remet les compteurs à zéro."""
+        with self._lock:
+            self._memory.clear()
+            self.hits = self.misses = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+                self._db_bytes = 0
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def configure_response_cache(max_entries=256, db_path=None, max_db_bytes=50 * 1024 * 1024):
+    """Crée (une seule fois par processus et par configuration) le cache de réponses partagé."""
+    global _response_cache
+    with _response_cache_lock:
+        cache = _response_cache
+        if cache is None or (cache.max_entries, cache.db_path, cache.max_db_bytes) != (max_entries, db_path, max_db_bytes):
+            _response_cache = ResponseCache(max_entries, db_path, max_db_bytes)
+        return _response_cache
+
+def get_response_cache():
+    """Retourne le cache de réponses partagé, ou None s'il n'a pas été configuré."""
+    return _response_cache
+
+def make_cache_key(model_name, messages, options):
+    """Empreinte stable du modèle, des messages et des options d'un appel à Ollama."""
+    payload = json.dumps({'model': model_name, 'messages': messages, 'options': options or {}}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+_usage_lock = threading.Lock()
+
+def _record_usage(usage, response):
+    """Ajoute les compteurs de tokens de la réponse au dictionnaire usage."""
+    with _usage_lock:
+        usage['calls'] = usage.get('calls', 0) + 1
+        usage['prompt_eval_count'] = usage.get('prompt_eval_count', 0) + (response.get('prompt_eval_count') or 0)
+        usage['eval_count'] = usage.get('eval_count', 0) + (response.get('eval_count') or 0)
+
+def _cached_chat(chat_fn, model_name, messages, options, use_cache=False, keep_alive=None, usage=None, entry_point="chat", character=None):
+    """Appelle chat_fn et retourne le contenu de la réponse, en passant par le cache si demandé.
+
+    Si usage est fourni, les compteurs de tokens des appels réels y sont cumulés.
+    Chaque appel est enregistré dans les métriques sous entry_point et character.
+    """
+    logger.debug("Messages envoyés à Ollama (%s, %s): %s", entry_point, model_name, messages)
+    start = time.perf_counter()
+    cache = _response_cache if use_cache else None
+    if cache is not None:
+        key = make_cache_key(model_name, messages, options)
+        content = cache.get(key)
+        if content is not None:
+            _metrics.record(entry_point, model_name, time.perf_counter() - start, character=character, cached=True)
+            return content
+    try:
+        response = chat_fn(
+            model=model_name,
+            messages=messages,
+            options=options,
+            keep_alive=keep_alive
+        )
+    except Exception as e:
+        _metrics.record(entry_point, model_name, time.perf_counter() - start, character=character, error=e)
+        raise
+    _metrics.record(entry_point, model_name, time.perf_counter() - start, response, character)
+    content = response['message']['content']
+    if usage is not None:
+        _record_usage(usage, response)
+    if cache is not None:
+        cache.put(key, content)
+    return content
+
+def get_chat_response(model_name, user_message, system_prompt="", user_prompt="", options=None, use_cache=False):
     """Retourne la réponse du modèle choisi avec prompts système et utilisateur, et options."""
     try:
         messages = []
@@ -60,111 +783,431 @@ def get_chat_response(model_name, user_message, system_prompt="", user_prompt=""
             messages.append({'role': 'system', 'content': system_prompt})
         messages.append({'role': 'user', 'content': user_prompt + "\n\n" + user_message if user_prompt else user_message})
         
-        response = chat(
-            model=model_name,
-            messages=messages,
-            options=options or {}
-        )
-        return response['message']['content']
+        return _cached_chat(chat, model_name, messages, options or {}, use_cache, entry_point="get_chat_response")
     except Exception as e:
         return f"Erreur: Impossible de contacter Ollama. Veuillez vérifier que le serveur Ollama est en cours d'exécution. Détails: {e}"
 
-def generate_dialogue_response(model_name, character, dialogue, system_prompt="", user_prompt="", options=None, context_lines=5, generation_count=0):
-    """Génère une réponse pour le personnage dans le dialogue, en utilisant le contexte récent."""
-    # Prendre les dernières context_lines messages
-    recent_context = dialogue[-context_lines:] if len(dialogue) > context_lines else dialogue
-    context_text = "\n".join(f"{speaker}: {msg}" for speaker, msg in recent_context)
+def _get_client(timeout=None):
+    """Retourne le pool de clients Ollama partagé, configuré avec le délai demandé."""
+    return get_client_pool().bind(timeout)
+
+# Priorité aux générations interactives : les tâches d'arrière-plan (résumés,
+# pré-génération) attendent qu'aucune génération interactive ne soit en cours.
+_interactive_condition = threading.Condition()
+_interactive_count = 0
+
+@contextmanager
+def interactive_generation():
+    """Déclare une génération interactive : les tâches d'arrière-plan lui laissent la priorité."""
+    global _interactive_count
+    with _interactive_condition:
+        _interactive_count += 1
+    try:
+        yield
+    finally:
+        with _interactive_condition:
+            _interactive_count -= 1
+            _interactive_condition.notify_all()
+
+def wait_for_interactive(cancelled=None, poll_interval=0.5):
+    """Attend qu'aucune génération interactive ne soit en cours (ou que cancelled() devienne vrai)."""
+    with _interactive_condition:
+        while _interactive_count and not (cancelled and cancelled()):
+            _interactive_condition.wait(poll_interval)
+
+# Construction du contexte : on estime les tokens de chaque réplique et on garde
+# autant de répliques récentes que le budget le permet ; les plus anciennes sont
+# condensées dans un résumé glissant, mis à jour par tranches en arrière-plan.
+DEFAULT_NUM_CTX = 2048          # num_ctx par défaut d'Ollama
+CHARS_PER_TOKEN = 3.5           # estimation grossière pour du français
+PROMPT_OVERHEAD_TOKENS = 150    # consignes fixes du prompt
+DEFAULT_MAX_NEW_TOKENS = 128
+MIN_CONTEXT_TOKENS = 128
+SUMMARY_MAX_TOKENS = 200        # longueur maximale du résumé
+SUMMARY_CHUNK_TURNS = 8         # le résumé n'est mis à jour qu'à partir de ce nombre de répliques sorties du contexte
+SUMMARY_INPUT_TOKENS = 1500     # répliques condensées par appel de résumé
+
+def estimate_tokens(text):
+    """Estime le nombre de tokens d'un texte (sans tokenizer, à partir du nombre de caractères)."""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def _format_turn(turn):
+    speaker, message = turn
+    return f"{speaker}: {message}"
+
+def _snapshot(dialogue):
+    """Vue figée d'un DialogueStore (les autres séquences sont retournées telles quelles)."""
+    snapshot = getattr(dialogue, 'snapshot', None)
+    return snapshot() if snapshot is not None else dialogue
+
+def pack_recent_turns(dialogue, budget_tokens, max_turns=None):
+    """Retourne (index de début, répliques) : les répliques les plus récentes qui tiennent dans le budget.
+
+    La dernière réplique est toujours incluse, tronquée si elle dépasse le budget seule.
+    """
+    end = len(dialogue)
+    start = end
+    used = 0
+    limit = end - max_turns if max_turns else 0
+    while start > max(limit, 0):
+        cost = estimate_tokens(_format_turn(dialogue[start - 1]))
+        if used + cost > budget_tokens and start < end:
+            break
+        used += cost
+        start -= 1
+    turns = list(dialogue[start:end]) if start < end else []
+    if turns and used > budget_tokens:
+        speaker, message = turns[-1]
+        turns[-1] = (speaker, message[-int(budget_tokens * CHARS_PER_TOKEN):])
+    return start, turns
+
+class _RollingSummary:
+    """Résumé des répliques [0, covered) d'un dialogue (ou d'une partie récente de l'historique)."""
+
+    def __init__(self, covered):
+        self.covered = covered
+        self.text = ""
+        self.fingerprint = None
+        self.pending = False
+
+_summaries = {}
+_summaries_lock = threading.Lock()
+_summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ollama-summary")
+
+def _turn_fingerprint(dialogue, index):
+    return hashlib.sha1(_format_turn(dialogue[index]).encode('utf-8')).hexdigest() if index >= 0 else None
+
+def _update_summary(key, summary, dialogue, model_name, target):
+    """Condense les répliques [covered, target) dans le résumé, une tranche par appel."""
+    try:
+        while summary.covered < target:
+            batch = []
+            used = 0
+            for index in range(summary.covered, target):
+                line = _format_turn(dialogue[index])
+                used += estimate_tokens(line)
+                if batch and used > SUMMARY_INPUT_TOKENS:
+                    break
+                batch.append(line)
+            previous = summary.text or "(aucun)"
+            messages = [
+                {'role': 'system', 'content': "Vous résumez des dialogues de manière factuelle et concise, sans inventer."},
+                {'role': 'user', 'content': f"Résumé précédent:\n{previous}\n\nNouvelles répliques:\n" + "\n".join(batch) +
+                 f"\n\nMettez à jour le résumé en moins de {int(SUMMARY_MAX_TOKENS * 0.6)} mots : personnages, faits importants, ton. Répondez uniquement avec le résumé."},
+            ]
+            options = {'temperature': 0.2, 'seed': DETERMINISTIC_SEED, 'num_predict': SUMMARY_MAX_TOKENS}
+            # Tâche d'arrière-plan : les générations interactives passent avant
+            wait_for_interactive()
+            text = _cached_chat(chat, model_name, messages, options, entry_point="summary").strip()
+            with _summaries_lock:
+                summary.text = text
+                summary.covered += len(batch)
+                summary.fingerprint = _turn_fingerprint(dialogue, summary.covered - 1)
+    except Exception as e:
+        logger.warning("Mise à jour du résumé impossible pour %s: %s", key[0], e)
+    finally:
+        with _summaries_lock:
+            summary.pending = False
+
+def get_rolling_summary(dialogue, model_name, window_start):
+    """Retourne le résumé disponible des répliques précédant window_start.
+
+    Le résumé est mis en cache par (fichier, modèle) et indexé par le nombre de
+    répliques couvertes. Quand au moins SUMMARY_CHUNK_TURNS répliques sont sorties
+    de la fenêtre depuis la dernière mise à jour, seules ces répliques sont
+    condensées, en arrière-plan ; en attendant, le résumé précédent est servi.
+    Seuls les dialogues liés à un fichier (DialogueStore et leurs vues) ont un résumé.
+    """
+    path = getattr(dialogue, 'path', None)
+    if path is None or model_name is None or window_start <= 0:
+        return ""
+    dialogue = _snapshot(dialogue)
+    key = (path, model_name)
+    with _summaries_lock:
+        summary = _summaries.get(key)
+        stale = summary is not None and (
+            summary.covered > len(dialogue) or
+            (summary.covered and summary.fingerprint != _turn_fingerprint(dialogue, summary.covered - 1)))
+        if summary is None or stale:
+            # Premier résumé (ou fichier réécrit) : on ne remonte qu'une tranche d'historique
+            lookback = int(SUMMARY_INPUT_TOKENS / max(1, estimate_tokens(_format_turn(dialogue[window_start - 1]))))
+            summary = _RollingSummary(max(0, window_start - max(SUMMARY_CHUNK_TURNS, lookback)))
+            summary.fingerprint = _turn_fingerprint(dialogue, summary.covered - 1)
+            _summaries[key] = summary
+        needs_update = not summary.pending and (window_start - summary.covered >= SUMMARY_CHUNK_TURNS or
+                                                (not summary.text and window_start > summary.covered))
+        if needs_update:
+            summary.pending = True
+        text = summary.text
+    if needs_update:
+        _summary_executor.submit(_update_summary, key, summary, dialogue, model_name, window_start)
+    return text
+
+def build_dialogue_context(dialogue, model_name=None, system_prompt="", user_prompt="", options=None, context_budget=None, max_turns=None, summarize=True):
+    """Construit le contexte du prompt : retourne (résumé des répliques anciennes, répliques récentes).
+
+    Le budget de tokens des répliques est context_budget s'il est fourni, sinon
+    num_ctx (options, ou DEFAULT_NUM_CTX) moins les prompts, les consignes,
+    la longueur de réponse demandée et la place réservée au résumé.
+    """
+    dialogue = _snapshot(dialogue)
+    options = options or {}
+    if context_budget is None:
+        max_new_tokens = options.get('num_predict') or options.get('max_tokens') or DEFAULT_MAX_NEW_TOKENS
+        reserved = estimate_tokens(system_prompt) + estimate_tokens(user_prompt) + PROMPT_OVERHEAD_TOKENS + max_new_tokens
+        if summarize:
+            reserved += SUMMARY_MAX_TOKENS
+        context_budget = max(MIN_CONTEXT_TOKENS, options.get('num_ctx', DEFAULT_NUM_CTX) - reserved)
+    start, turns = pack_recent_turns(dialogue, context_budget, max_turns)
+    summary = get_rolling_summary(dialogue, model_name, start) if summarize else ""
+    return summary, turns
+
+def _build_dialogue_messages(character, dialogue, system_prompt="", user_prompt="", context_lines=None, prompt_layout=DEFAULT_PROMPT_LAYOUT, variant=None, model_name=None, options=None, context_budget=None, summarize=True):
+    """Construit la liste de messages envoyée à Ollama et retourne (messages, instruction).
+
+    Le contexte vient de build_dialogue_context : répliques récentes dans le
+    budget de tokens (au plus context_lines si fourni) et résumé des plus anciennes.
+    Avec variant (mode déterministe), l'instruction est choisie par son index
+    et aucun identifiant unique n'est ajouté : les messages sont reproductibles.
+    """
+    if prompt_layout not in PROMPT_LAYOUTS:
+        raise ValueError(f"Disposition de prompt inconnue : {prompt_layout} (attendu : {', '.join(PROMPT_LAYOUTS)})")
+
+    # Répliques récentes qui tiennent dans le budget, et résumé des précédentes
+    summary, recent_context = build_dialogue_context(dialogue, model_name, system_prompt, user_prompt, options, context_budget, context_lines, summarize)
+    context_text = "\n".join(_format_turn(turn) for turn in recent_context)
+    if summary:
+        # En tête du message : le résumé ne change que par tranches, le préfixe reste stable
+        context_text = f"Résumé des échanges précédents:\n{summary}\n\nDialogue récent:\n{context_text}"
+    else:
+        context_text = f"Dialogue récent:\n{context_text}"
 
     # Instruction aléatoire pour plus de variété
-    random_instruction = random.choice([
-        "Réponds de manière naturelle et immersive.",
-        "Continue l'histoire de façon engageante.",
-        "Réagis comme le personnage le ferait.",
-        "Apporte de la tension ou de l'humour.",
-        "Développe la réponse de manière détaillée.",
-        "Sois créatif dans ta réponse."
-    ])
-
-    # Ajout d'un identifiant unique pour invalider le cache
-    unique_id = f"\nUnique ID: {uuid.uuid4()}-{time.time()}"
-    prompt = f"Dialogue récent:\n{context_text}\n\n{random_instruction}\nRépondez en tant que {character} de façon naturelle et cohérente. {user_prompt}\n\nIMPORTANT: Répondez UNIQUEMENT avec les paroles directes de {character}, sans écrire son nom, sans guillemets, sans préfixe. Juste le contenu de ce qu'il dit.{unique_id}"
+    if variant is None:
+        random_instruction = random.choice(RANDOM_INSTRUCTIONS)
+    else:
+        random_instruction = RANDOM_INSTRUCTIONS[variant % len(RANDOM_INSTRUCTIONS)]
 
     messages = []
-    if system_prompt:
-        messages.append({'role': 'system', 'content': f"{system_prompt}\n\nRègle stricte: Vous êtes {character}. Ne jamais inclure le nom du personnage dans votre réponse. Répondez directement avec les paroles."})
+    if prompt_layout == "legacy":
+        # Ajout d'un identifiant unique pour invalider le cache
+        unique_id = f"\nUnique ID: {uuid.uuid4()}-{time.time()}" if variant is None else ""
+        prompt = f"{context_text}\n\n{random_instruction}\nRépondez en tant que {character} de façon naturelle et cohérente. {user_prompt}\n\nIMPORTANT: Répondez UNIQUEMENT avec les paroles directes de {character}, sans écrire son nom, sans guillemets, sans préfixe. Juste le contenu de ce qu'il dit.{unique_id}"
+        if system_prompt:
+            messages.append({'role': 'system', 'content': f"{system_prompt}\n\nRègle stricte: Vous êtes {character}. Ne jamais inclure le nom du personnage dans votre réponse. Répondez directement avec les paroles."})
+    else:
+        # Préfixe stable (système + dialogue) puis consignes variables en fin de message :
+        # la variété vient de la graine et de l'instruction, placées après le préfixe.
+        prompt = f"{context_text}\n\nRépondez en tant que {character} de façon naturelle et cohérente. {user_prompt}\n\nIMPORTANT: Répondez UNIQUEMENT avec les paroles directes de {character}, sans écrire son nom, sans guillemets, sans préfixe. Juste le contenu de ce qu'il dit.\n{random_instruction}"
+        if system_prompt:
+            messages.append({'role': 'system', 'content': f"{system_prompt}\n\nRègle stricte: Vous incarnez le personnage indiqué. Ne jamais inclure le nom du personnage dans votre réponse. Répondez directement avec les paroles."})
     messages.append({'role': 'user', 'content': prompt})
+    return messages, random_instruction
 
-    # Options avec graine aléatoire et désactivation explicite du cache
+def _generation_options(options, variant=None, jitter_temperature=True):
+    """Options d'appel : graine aléatoire (ou DETERMINISTIC_SEED + variant en mode déterministe)."""
     final_options = options.copy() if options else {}
+    if variant is not None:
+        final_options['seed'] = final_options.get('seed', DETERMINISTIC_SEED) + variant
+        return final_options
     final_options['seed'] = random.randint(0, 1000000)
-    # Randomize temperature slightly for more variety
-    base_temp = final_options.get('temperature', 1.0)
-    final_options['temperature'] = base_temp + random.uniform(-0.2, 0.2)
+    if jitter_temperature:
+        # Randomize temperature slightly for more variety
+        base_temp = final_options.get('temperature', 1.0)
+        final_options['temperature'] = base_temp + random.uniform(-0.2, 0.2)
+    return final_options
+
+def generate_dialogue_response(model_name, character, dialogue, system_prompt="", user_prompt="", options=None, context_lines=None, generation_count=0, prompt_layout=DEFAULT_PROMPT_LAYOUT, keep_alive=None, use_cache=False, deterministic=False, context_budget=None, summarize=True):
+    """Génère une réponse pour le personnage dans le dialogue, en utilisant le contexte récent.
 
-    # Journalisation des messages pour débogage
-    print("Messages envoyés à Ollama:", messages)
+    use_cache sert la réponse depuis le cache de réponses s'il la contient ;
+    deterministic fixe la graine et l'instruction (variante generation_count)
+    pour que le même état de dialogue produise (et retrouve en cache) la même
+    réponse. use_cache implique deterministic : une graine aléatoire dans la
+    clé ne donnerait jamais de hit. En mode déterministe, le résumé glissant
+    (mis à jour en arrière-plan) n'est pas utilisé : le prompt ne dépend que
+    de l'état du dialogue.
+    """
+    dialogue = _snapshot(dialogue)
+    deterministic = deterministic or use_cache
+    summarize = summarize and not deterministic
+    variant = generation_count if deterministic else None
+    messages, random_instruction = _build_dialogue_messages(character, dialogue, system_prompt, user_prompt, context_lines, prompt_layout, variant,
+                                                             model_name, options, context_budget, summarize)
+    final_options = _generation_options(options, variant)
 
     try:
-        response = chat(
-            model=model_name,
-            messages=messages,
-            options=final_options
-        )
+        content = _cached_chat(chat, model_name, messages, final_options, use_cache, keep_alive,
+                               entry_point="generate_dialogue_response", character=character)
         # Post-traitement pour nettoyer la réponse
-        cleaned_response = clean_response(response['message']['content'], character)
+        cleaned_response = clean_response(content, character)
         return cleaned_response, random_instruction
     except Exception as e:
         return f"Erreur: Impossible de contacter Ollama. Veuillez vérifier que le serveur Ollama est en cours d'exécution. Détails: {e}", random_instruction
 
-def generate_multiple_responses(model_name, character, dialogue, system_prompt="", user_prompt="", options=None, context_lines=5, generation_count=0, num_responses=3):
-    """Génère plusieurs réponses pour le personnage dans le dialogue."""
-    responses = []
-    for _ in range(num_responses):
-        # Prendre les dernières context_lines messages
-        recent_context = dialogue[-context_lines:] if len(dialogue) > context_lines else dialogue
-        context_text = "\n".join(f"{speaker}: {msg}" for speaker, msg in recent_context)
-
-        # Instruction aléatoire pour plus de variété
-        random_instruction = random.choice([
-            "Réponds de manière naturelle et immersive.",
-            "Continue l'histoire de façon engageante.",
-            "Réagis comme le personnage le ferait.",
-            "Apporte de la tension ou de l'humour.",
-            "Développe la réponse de manière détaillée.",
-            "Sois créatif dans ta réponse."
-        ])
+class _StreamCleaner:
+    """Applique le nettoyage de clean_response sur un flux de fragments.
 
-        # Ajout d'un identifiant unique pour invalider le cache
-        unique_id = f"\nUnique ID: {uuid.uuid4()}-{time.time()}"
-        prompt = f"Dialogue récent:\n{context_text}\n\n{random_instruction}\nRépondez en tant que {character} de façon naturelle et cohérente. {user_prompt}\n\nIMPORTANT: Répondez UNIQUEMENT avec les paroles directes de {character}, sans écrire son nom, sans guillemets, sans préfixe. Juste le contenu de ce qu'il dit.{unique_id}"
+    Le début du flux est retenu jusqu'à ce que le préfixe de nom (« Enseignant: »,
+    « **Enseignant**: ») soit tranché, et les guillemets/espaces de fin sont
+    retenus tant que le flux n'est pas terminé : le nom ou un guillemet
+    parasite n'est donc jamais affiché, même brièvement.
+    """
 
-        messages = []
-        if system_prompt:
-            messages.append({'role': 'system', 'content': f"{system_prompt}\n\nRègle stricte: Vous êtes {character}. Ne jamais inclure le nom du personnage dans votre réponse. Répondez directement avec les paroles."})
-        messages.append({'role': 'user', 'content': prompt})
+    QUOTES = '"\''
+
+    def __init__(self, character_name):
+        self.character_name = character_name
+        # "**" + nom + "**" + ":" + un espace : au-delà, le préfixe ne peut plus évoluer
+        self.head_limit = len(character_name) + 6
+        self.head = ""
+        self.head_done = False
+        self.pending = ""
+
+    def feed(self, fragment):
+        """Ajoute un fragment et retourne le texte nettoyé affichable immédiatement."""
+        if not self.head_done:
+            self.head += fragment
+            if len(self.head.lstrip()) <= self.head_limit:
+                return ""
+            self.head_done = True
+            fragment = self._clean_head(self.head)
+        text = self.pending + fragment
+        kept = text.rstrip(self.QUOTES + " \t\r\n")
+        self.pending = text[len(kept):]
+        return kept
+
+    def finish(self):
+        """Termine le flux et retourne le reliquat éventuel."""
+        if not self.head_done:
+            self.head_done = True
+            return clean_response(self.head, self.character_name)
+        return ""
+
+    def _clean_head(self, text):
+        cleaned = text.lstrip()
+        for pattern in _name_prefix_patterns(self.character_name):
+            cleaned = re.sub(pattern, "", cleaned, flags=re.IGNORECASE)
+        return cleaned.lstrip(self.QUOTES + " \t\r\n")
 
-        # Options avec graine aléatoire et désactivation explicite du cache
-        final_options = options.copy() if options else {}
-        final_options['seed'] = random.randint(0, 1000000)
+def stream_dialogue_response(model_name, character, dialogue, system_prompt="", user_prompt="", options=None, context_lines=None, stats=None, prompt_layout=DEFAULT_PROMPT_LAYOUT, keep_alive=None, use_cache=False, deterministic=False, context_budget=None, summarize=True):
+    """Variante en streaming de generate_dialogue_response : génère les fragments nettoyés.
+
+    Si un dictionnaire stats est fourni, il reçoit l'instruction utilisée
+    ('instruction'), le délai avant le premier fragment affiché
+    ('time_to_first_token', en secondes), la durée totale ('total_time') et
+    'cached' si la réponse vient du cache de réponses. Comme pour
+    generate_dialogue_response, use_cache implique deterministic, et le mode
+    déterministe se passe du résumé glissant.
+    """
+    dialogue = _snapshot(dialogue)
+    deterministic = deterministic or use_cache
+    summarize = summarize and not deterministic
+    variant = 0 if deterministic else None
+    messages, random_instruction = _build_dialogue_messages(character, dialogue, system_prompt, user_prompt, context_lines, prompt_layout, variant,
+                                                             model_name, options, context_budget, summarize)
+    if stats is not None:
+        stats['instruction'] = random_instruction
+        stats['time_to_first_token'] = None
+        stats['cached'] = False
+
+    final_options = _generation_options(options, variant)
+    cache = _response_cache if use_cache else None
+    cache_key = make_cache_key(model_name, messages, final_options) if cache is not None else None
+
+    cleaner = _StreamCleaner(character)
+    start = time.perf_counter()
+
+    def emit(text):
+        if stats is not None and stats['time_to_first_token'] is None:
+            stats['time_to_first_token'] = time.perf_counter() - start
+        return text
+
+    logger.debug("Messages envoyés à Ollama (stream_dialogue_response, %s): %s", model_name, messages)
+    last_chunk = None
+    try:
+        cached = cache.get(cache_key) if cache is not None else None
+        if cached is not None:
+            if stats is not None:
+                stats['cached'] = True
+            _metrics.record("stream_dialogue_response", model_name, time.perf_counter() - start, character=character, cached=True)
+            yield emit(clean_response(cached, character))
+            return
+        content = []
+        for chunk in chat(model=model_name, messages=messages, options=final_options, stream=True, keep_alive=keep_alive):
+            last_chunk = chunk
+            content.append(chunk['message']['content'])
+            delta = cleaner.feed(content[-1])
+            if delta:
+                yield emit(delta)
+        if cache is not None:
+            cache.put(cache_key, "".join(content))
+        # Le dernier fragment (done=True) porte les durées et compteurs de tokens
+        _metrics.record("stream_dialogue_response", model_name, time.perf_counter() - start, last_chunk, character)
+        tail = cleaner.finish()
+        if tail:
+            yield emit(tail)
+    except Exception as e:
+        _metrics.record("stream_dialogue_response", model_name, time.perf_counter() - start, last_chunk, character, error=e)
+        yield emit(f"Erreur: Impossible de contacter Ollama. Veuillez vérifier que le serveur Ollama est en cours d'exécution. Détails: {e}")
+    finally:
+        if stats is not None:
+            stats['total_time'] = time.perf_counter() - start
+
+def _generate_candidate(client, model_name, character, messages, options, prompt_layout=DEFAULT_PROMPT_LAYOUT, keep_alive=None, use_cache=False, variant=None, usage=None):
+    """Génère une réponse candidate ; une erreur est renvoyée comme texte sans interrompre les autres."""
+    # Options avec graine aléatoire et désactivation explicite du cache
+    final_options = _generation_options(options, variant, jitter_temperature=False)
+    if prompt_layout == "legacy" and variant is None:
         final_options['disable_cache'] = True  # Désactivation explicite du cache si supporté
 
-        # Appel au modèle
-        try:
-            response = chat(
-                model=model_name,
-                messages=messages,
-                options=final_options
-            )
-            # Post-traitement pour nettoyer la réponse
-            cleaned_response = clean_response(response['message']['content'], character)
-            responses.append(cleaned_response)
-        except Exception as e:
-            responses.append(f"Erreur: Impossible de contacter Ollama. Veuillez vérifier que le serveur Ollama est en cours d'exécution. Détails: {e}")
+    try:
+        content = _cached_chat(client.chat, model_name, messages, final_options, use_cache, keep_alive, usage,
+                               entry_point="generate_multiple_responses", character=character)
+        # Post-traitement pour nettoyer la réponse
+        return clean_response(content, character)
+    except Exception as e:
+        return f"Erreur: Impossible de contacter Ollama. Veuillez vérifier que le serveur Ollama est en cours d'exécution. Détails: {e}"
 
-    return responses
+def generate_multiple_responses(model_name, character, dialogue, system_prompt="", user_prompt="", options=None, context_lines=None, generation_count=0, num_responses=3, max_workers=None, request_timeout=None, prompt_layout=DEFAULT_PROMPT_LAYOUT, keep_alive=None, use_cache=False, deterministic=False, usage=None, context_budget=None, summarize=True):
+    """Génère plusieurs réponses pour le personnage dans le dialogue.
+
+    Les requêtes partent en parallèle (au plus max_workers à la fois) et chacune
+    est limitée à request_timeout secondes. Les réponses sont retournées dans
+    l'ordre de soumission ; un échec n'annule pas les autres candidates.
+    En mode deterministic, la candidate i utilise la graine DETERMINISTIC_SEED + i,
+    ce qui rend le lot reproductible et resservable depuis le cache ; use_cache
+    implique deterministic, et le mode déterministe se passe du résumé glissant.
+    Si usage est fourni, il reçoit le nombre d'appels et de tokens consommés.
+    """
+    if num_responses <= 0:
+        return []
+    dialogue = _snapshot(dialogue)  # toutes les candidates partent du même état du dialogue
+    deterministic = deterministic or use_cache
+    summarize = summarize and not deterministic
+    max_workers = max(1, min(max_workers or DEFAULT_MAX_WORKERS, num_responses))
+    client = _get_client(request_timeout or DEFAULT_REQUEST_TIMEOUT)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ollama-gen") as executor:
+        futures = []
+        for i in range(num_responses):
+            variant = i if deterministic else None
+            messages, _instruction = _build_dialogue_messages(character, dialogue, system_prompt, user_prompt, context_lines, prompt_layout, variant,
+                                                             model_name, options, context_budget, summarize)
+            futures.append(executor.submit(_generate_candidate, client, model_name, character, messages, options, prompt_layout, keep_alive, use_cache, variant, usage))
+        return [future.result() for future in futures]
 
 def list_log_files(folder_path):
-    """Liste les fichiers .txt dans le dossier, triés par date de modification (plus récent en premier)."""
+    """Liste les fichiers .txt dans le dossier, triés par date de modification (plus récent en premier).
+
+    Si l'index de dossiers surveillés couvre ce dossier, la liste est servie
+    depuis la mémoire sans parcourir le disque.
+    """
+    index = _directory_index
+    if index is not None:
+        files = index.files(folder_path)
+        if files is not None:
+            return files
     folder = Path(folder_path)
     if not folder.exists() or not folder.is_dir():
         return []
@@ -172,25 +1215,830 @@ def list_log_files(folder_path):
     txt_files.sort(key=lambda x: x.stat().st_mtime, reverse=True)  # Plus récent en premier
     return [str(f) for f in txt_files]
 
+class _DirectoryEventHandler(FileSystemEventHandler):
+    """Relaie les événements watchdog vers l'index de dossiers."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.index._update_file(event.src_path, changed=True)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.index._update_file(event.src_path, changed=True)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.index._remove_file(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.index._remove_file(event.src_path)
+            self.index._update_file(event.dest_path, changed=True)
+
+class DialogueDirectoryIndex:
+    """Index en mémoire des fichiers de dialogue des dossiers surveillés.
+
+    Chaque dossier est parcouru une seule fois, puis tenu à jour par les
+    événements watchdog (création, modification, suppression, déplacement).
+    Si les événements natifs du système (inotify...) ne sont pas disponibles,
+    l'index bascule sur un observateur par scrutation.
+    """
+
+    def __init__(self, polling=False, poll_interval=2.0):
+        self.polling = polling
+        self.poll_interval = poll_interval
+        self._folders = {}      # dossier absolu -> {chemin: mtime}
+        self._sorted = {}       # dossier absolu -> liste triée (invalidée à chaque changement)
+        self._watches = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._observer = None
+
+    def _start_observer(self):
+        observer = PollingObserver(timeout=self.poll_interval) if self.polling else Observer()
+        observer.start()
+        return observer
+
+    def _schedule(self, folder):
+        if self._observer is None:
+            self._observer = self._start_observer()
+        self._watches[folder] = self._observer.schedule(_DirectoryEventHandler(self), folder, recursive=False)
+
+    def watch(self, folder_path):
+        """Ajoute un dossier à l'index et commence à le surveiller."""
+        folder = os.path.abspath(folder_path)
+        if folder in self._folders or not os.path.isdir(folder):
+            return
+        try:
+            self._schedule(folder)
+        except OSError as e:
+            if self.polling:
+                raise
+            # inotify indisponible ou limite de surveillances atteinte : scrutation
+            logger.warning("Surveillance native indisponible pour %s (%s), bascule sur la scrutation.", folder, e)
+            self.stop()
+            self.polling = True
+            for watched in list(self._watches):
+                self._schedule(watched)
+            self._schedule(folder)
+        entries = {}
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.txt'):
+                    entries[entry.path] = entry.stat().st_mtime
+        with self._lock:
+            self._folders[folder] = entries
+            self._sorted.pop(folder, None)
+
+    def add_listener(self, callback):
+        """Appelle callback(chemin) après chaque modification d'un fichier indexé (depuis le thread watchdog)."""
+        with self._lock:
+            if callback not in self._listeners:
+                self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def files(self, folder_path):
+        """Retourne les fichiers du dossier (plus récent en premier), ou None s'il n'est pas indexé."""
+        folder = os.path.abspath(folder_path)
+        with self._lock:
+            entries = self._folders.get(folder)
+            if entries is None:
+                return None
+            files = self._sorted.get(folder)
+            if files is None:
+                files = sorted(entries, key=entries.get, reverse=True)
+                self._sorted[folder] = files
+            return list(files)
+
+    def _update_file(self, path, changed=False):
+        path = os.path.abspath(path)
+        folder = os.path.dirname(path)
+        if folder not in self._folders or not path.endswith('.txt'):
+            return
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            self._remove_file(path)
+            return
+        with self._lock:
+            self._folders[folder][path] = mtime
+            self._sorted.pop(folder, None)
+        if changed:
+            _refresh_cached_dialogue(path)
+            with self._lock:
+                listeners = list(self._listeners)
+            for callback in listeners:
+                try:
+                    callback(path)
+                except Exception:
+                    logger.exception("Erreur dans un écouteur de l'index pour %s", path)
+
+    def _remove_file(self, path):
+        path = os.path.abspath(path)
+        folder = os.path.dirname(path)
+        with self._lock:
+            entries = self._folders.get(folder)
+            if entries is not None and entries.pop(path, None) is not None:
+                self._sorted.pop(folder, None)
+        invalidate_dialogue_cache(path)
+
+    def stop(self):
+        """Arrête la surveillance."""
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+_directory_index = None
+_directory_index_lock = threading.Lock()
+
+def start_directory_index(folders, polling=False, poll_interval=2.0):
+    """Démarre (une seule fois par processus) l'index surveillé des dossiers de dialogues.
+
+    Les appels suivants ajoutent simplement les nouveaux dossiers à l'index existant.
+    """
+    global _directory_index
+    with _directory_index_lock:
+        if _directory_index is None:
+            _directory_index = DialogueDirectoryIndex(polling=polling, poll_interval=poll_interval)
+        for folder in folders:
+            _directory_index.watch(folder)
+        return _directory_index
+
+# Pré-génération spéculative : quand le fichier actif change, on prédit le
+# prochain personnage et on génère ses réponses avant le clic.
+PREDICTION_LOOKBACK = 50
+
+def predict_next_speaker(dialogue, lookback=PREDICTION_LOOKBACK):
+    """Prédit le prochain personnage à parler d'après l'alternance des dernières répliques.
+
+    On compte, sur les lookback dernières répliques, qui a répondu au dernier
+    personnage ; à défaut, on prend le personnage précédent différent du dernier.
+    """
+    turns = dialogue[-lookback:]
+    if not turns:
+        return None
+    last = turns[-1][0]
+    followers = {}
+    for (speaker, _), (following, _) in zip(turns, turns[1:]):
+        if speaker == last and following != last:
+            followers[following] = followers.get(following, 0) + 1
+    if followers:
+        return max(followers, key=followers.get)
+    for speaker, _ in reversed(turns):
+        if speaker != last:
+            return speaker
+    return None
+
+class PregenerationScheduler:
+    """Génère en arrière-plan les réponses du prochain personnage du fichier actif.
+
+    Chaque modification du fichier (événement de l'index de dossiers) planifie
+    une tâche pour la nouvelle fin du dialogue et annule les tâches précédentes
+    du même fichier : une génération déjà envoyée à Ollama va à son terme mais
+    son résultat est ignoré. La file est bornée (les tâches les plus anciennes
+    sont abandonnées) et les générations interactives, déclarées avec
+    interactive(), passent avant : le thread de pré-génération attend qu'elles
+    soient terminées avant de lancer l'appel suivant.
+
+    Le fichier suivi et les réglages sont propres à chaque session (un onglet
+    de l'interface, désigné par l'argument session) : les tâches, résultats et
+    annulations d'une session ne touchent pas les autres. Au-delà de
+    max_sessions, les sessions les moins récemment vues sont oubliées.
+    """
+
+    def __init__(self, num_candidates=1, max_pending=2, max_results=16, max_sessions=16):
+        self.num_candidates = num_candidates
+        self.max_pending = max_pending
+        self.max_results = max_results
+        self.max_sessions = max_sessions
+        self._condition = threading.Condition()
+        self._queue = deque()
+        self._sessions = OrderedDict()  # session -> {'settings': réglages, 'active': chemin suivi}
+        self._versions = {}             # (session, chemin) -> version ; une nouvelle version annule les tâches précédentes
+        self._last_version = 0
+        self._scheduled = {}            # (session, chemin) -> (fin du dialogue, réglages) de la dernière tâche planifiée
+        self._results = OrderedDict()   # (session, chemin, personnage, fin du dialogue, réglages) -> [(réponse, instruction)]
+        self._thread = None
+        self.stats = {'scheduled': 0, 'completed': 0, 'cancelled': 0, 'dropped': 0, 'hits': 0, 'misses': 0}
+
+    def _session(self, session):
+        """État de la session, créé au besoin (appelé sous self._condition)."""
+        state = self._sessions.get(session)
+        if state is None:
+            state = self._sessions[session] = {'settings': None, 'active': None}
+            while len(self._sessions) > self.max_sessions:
+                # Ses tâches en file sont annulées (session inconnue) ; ses versions ne servent plus
+                forgotten, _ = self._sessions.popitem(last=False)
+                self._discard(forgotten)
+                for key in [key for key in self._versions if key[0] == forgotten]:
+                    del self._versions[key]
+        else:
+            self._sessions.move_to_end(session)
+        return state
+
+    def _bump(self, key):
+        """Nouvelle version pour (session, chemin) : les tâches planifiées avant sont annulées."""
+        self._last_version += 1
+        self._versions[key] = self._last_version
+        return self._last_version
+
+    def _discard(self, session):
+        """Annule les tâches et oublie les résultats de la session."""
+        for key in [key for key in self._versions if key[0] == session]:
+            self._bump(key)
+        for key in [key for key in self._scheduled if key[0] == session]:
+            del self._scheduled[key]
+        for key in [key for key in self._results if key[0] == session]:
+            del self._results[key]
+
+    def configure(self, model_name, system_prompt="", user_prompt="", options=None, prompt_layout=DEFAULT_PROMPT_LAYOUT,
+                  keep_alive=None, context_budget=None, deterministic=False, session=None):
+        """Définit les réglages de génération de la session ({character} est remplacé dans user_prompt).
+
+        Un changement de réglages annule les tâches en cours de la session et replanifie son fichier actif.
+        """
+        settings = (model_name, system_prompt, user_prompt, tuple(sorted((options or {}).items())),
+                    prompt_layout, keep_alive, context_budget, deterministic)
+        with self._condition:
+            state = self._session(session)
+            if settings == state['settings']:
+                return
+            state['settings'] = settings
+            self._discard(session)
+            active = state['active']
+        if active:
+            self.schedule(active, session)
+
+    def set_active(self, file_path, session=None):
+        """Choisit le fichier suivi par la session (None pour suspendre sa pré-génération)."""
+        path = os.path.abspath(file_path) if file_path else None
+        with self._condition:
+            state = self._session(session)
+            if path == state['active']:
+                return
+            if state['active']:
+                self._bump((session, state['active']))
+                self._scheduled.pop((session, state['active']), None)
+            state['active'] = path
+        if path:
+            self.schedule(path, session)
+
+    def on_file_changed(self, file_path):
+        """Écouteur de l'index de dossiers : replanifie pour les sessions dont c'est le fichier actif."""
+        path = os.path.abspath(file_path)
+        with self._condition:
+            sessions = [session for session, state in self._sessions.items() if state['active'] == path]
+        for session in sessions:
+            self.schedule(path, session)
+
+    @staticmethod
+    def _tail_key(dialogue):
+        return (len(dialogue), tuple(dialogue[-3:]))
+
+    def schedule(self, file_path, session=None):
+        """Planifie la pré-génération pour la fin actuelle du dialogue (sans effet si elle est déjà planifiée)."""
+        path = os.path.abspath(file_path)
+        try:
+            dialogue = get_dialogue(path).snapshot()
+        except (OSError, ValueError) as e:
+            logger.warning("Pré-génération impossible pour %s: %s", path, e)
+            return
+        character = predict_next_speaker(dialogue)
+        with self._condition:
+            state = self._sessions.get(session)
+            settings = state['settings'] if state else None
+            if settings is None or character is None:
+                return
+            key = (session, path)
+            tail = self._tail_key(dialogue)
+            if self._scheduled.get(key) == (tail, settings):
+                return
+            self._scheduled[key] = (tail, settings)
+            version = self._bump(key)
+            self._queue.append({'session': session, 'path': path, 'version': version, 'character': character,
+                                'dialogue': dialogue, 'tail': tail, 'settings': settings})
+            self.stats['scheduled'] += 1
+            # File bornée par session : une session active n'évince pas les tâches des autres
+            pending = [job for job in self._queue if job['session'] == session]
+            for job in pending[:max(0, len(pending) - self.max_pending)]:
+                self._queue.remove(job)
+                self.stats['dropped'] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ollama-pregeneration", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def _cancelled(self, job):
+        state = self._sessions.get(job['session'])
+        return (state is None or state['settings'] != job['settings'] or
+                self._versions.get((job['session'], job['path'])) != job['version'])
+
+    def _is_cancelled(self, job):
+        with self._condition:
+            return self._cancelled(job)
+
+    def _generate(self, job):
+        """Génère les réponses candidates de la tâche ; s'arrête à la première erreur ou annulation."""
+        model_name, system_prompt, user_prompt, options, prompt_layout, keep_alive, context_budget, deterministic = job['settings']
+        candidates = []
+        for generation_count in range(self.num_candidates):
+            wait_for_interactive(lambda: self._is_cancelled(job))
+            if self._is_cancelled(job):
+                break
+            response, instruction = generate_dialogue_response(
+                model_name, job['character'], job['dialogue'], system_prompt, user_prompt.replace("{character}", job['character']),
+                dict(options), generation_count=generation_count, prompt_layout=prompt_layout, keep_alive=keep_alive,
+                deterministic=deterministic, context_budget=context_budget)
+            if response.startswith("Erreur:"):
+                break
+            candidates.append((response, instruction))
+        return candidates
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                job = self._queue.popleft()
+            try:
+                candidates = self._generate(job)
+            except Exception:
+                # Une tâche en échec ne doit pas arrêter le thread : les suivantes restent servies
+                logger.exception("Pré-génération en échec pour %s (%s)", job['path'], job['character'])
+                candidates = []
+            with self._condition:
+                if self._cancelled(job) or not candidates:
+                    self.stats['cancelled'] += 1
+                    continue
+                key = (job['session'], job['path'], job['character'], job['tail'], job['settings'])
+                self._results[key] = candidates
+                while len(self._results) > self.max_results:
+                    self._results.popitem(last=False)
+                self.stats['completed'] += 1
+            logger.debug("Pré-génération prête pour %s (%s, %d réponse(s))", job['path'], job['character'], len(candidates))
+
+    def _settings(self, session):
+        state = self._sessions.get(session)
+        return state['settings'] if state else None
+
+    def take(self, file_path, character, session=None):
+        """Retourne une réponse pré-générée (réponse, instruction) pour la fin actuelle du dialogue, ou None."""
+        path = os.path.abspath(file_path)
+        tail = self._tail_key(get_dialogue(path).snapshot())
+        with self._condition:
+            key = (session, path, character, tail, self._settings(session))
+            candidates = self._results.get(key)
+            if not candidates:
+                self.stats['misses'] += 1
+                return None
+            response = candidates.pop(0)
+            if not candidates:
+                del self._results[key]
+            self.stats['hits'] += 1
+            return response
+
+    def ready(self, file_path, session=None):
+        """Personnages pour lesquels une réponse pré-générée correspond à la fin actuelle du dialogue."""
+        path = os.path.abspath(file_path)
+        tail = self._tail_key(get_dialogue(path).snapshot())
+        with self._condition:
+            settings = self._settings(session)
+            return [key[2] for key, candidates in self._results.items()
+                    if candidates and key[:2] == (session, path) and key[3] == tail and key[4] == settings]
+
+    def interactive(self):
+        """Déclare une génération interactive : la pré-génération (et les résumés) lui laissent la priorité."""
+        return interactive_generation()
+
+_pregeneration_scheduler = None
+_pregeneration_lock = threading.Lock()
+
+def start_pregeneration_scheduler(num_candidates=1, max_pending=2):
+    """Crée (une seule fois par processus) le planificateur de pré-génération et l'abonne à l'index de dossiers."""
+    global _pregeneration_scheduler
+    with _pregeneration_lock:
+        if _pregeneration_scheduler is None:
+            _pregeneration_scheduler = PregenerationScheduler(num_candidates, max_pending)
+        _pregeneration_scheduler.num_candidates = num_candidates
+        _pregeneration_scheduler.max_pending = max_pending
+        if _directory_index is not None:
+            _directory_index.add_listener(_pregeneration_scheduler.on_file_changed)
+        return _pregeneration_scheduler
+
+# Cache des dialogues parsés, indexé par chemin et validé par (taille, mtime).
+# Quand un fichier a seulement grandi, seuls les octets ajoutés sont parsés.
+# Le cache est borné (LRU) ; les stores ne gardent aucun fichier ouvert.
+_DIALOGUE_CHECK_BYTES = 64
+_DIALOGUE_CHUNK_BYTES = 4 * 1024 * 1024
+DIALOGUE_CACHE_SIZE = 64
+
+_dialogue_cache = OrderedDict()
+_dialogue_cache_lock = threading.Lock()
+
+def _line_boundary(data):
+    """Position après la dernière fin de ligne complète de data (\n, \r\n ou \r), 0 s'il n'y en a pas.
+
+    Un \r en dernier octet n'est pas retenu : il peut être suivi d'un \n pas encore lu.
+    """
+    return max(data.rfind(b"\n"), data.rfind(b"\r", 0, len(data) - 1)) + 1
+
+def _decode_lines(data, errors='strict'):
+    """Décode des octets comme open(..., encoding='utf-8') en mode texte (fins de ligne universelles)."""
+    return data.decode('utf-8', errors).replace("\r\n", "\n").replace("\r", "\n")
+
+class _DialogueIndex:
+    """Texte et index d'une version du fichier de dialogue.
+
+    Le texte est conservé par segments (un par bloc lu), déjà décodés ; un
+    segment n'est jamais modifié. Quand le fichier grandit, des segments et
+    des entrées sont ajoutés ; quand il est réécrit, un nouvel index est
+    construit puis substitué d'un bloc, si bien qu'un lecteur concurrent ne
+    voit jamais que des chaînes en mémoire.
+    """
+
+    def __init__(self):
+        self.segments = []
+        self.speaker_ids = {}            # nom -> id
+        self.speaker_names = []          # id -> nom
+        self.speaker_turns = []          # id -> array des indices de répliques
+        self.turn_speakers = array('I')  # réplique -> id du personnage
+        self.turn_segments = array('I')  # réplique -> segment
+        self.msg_starts = array('I')     # réplique -> début du message dans le segment
+        self.msg_ends = array('I')
+        self.line_segments = array('I')  # lignes non vides, telles qu'affichées
+        self.line_starts = array('I')
+        self.line_ends = array('I')
+        self.partial_turns = 0           # répliques issues d'une dernière ligne sans fin de ligne
+        self.partial_lines = 0
+        self.partial_segment = False
+
+    def turn(self, index):
+        segment = self.segments[self.turn_segments[index]]
+        return (self.speaker_names[self.turn_speakers[index]], segment[self.msg_starts[index]:self.msg_ends[index]])
+
+    def line(self, index):
+        return self.segments[self.line_segments[index]][self.line_starts[index]:self.line_ends[index]]
+
+    def drop_partial(self):
+        for _ in range(self.partial_turns):
+            self.speaker_turns[self.turn_speakers.pop()].pop()
+            self.turn_segments.pop()
+            self.msg_starts.pop()
+            self.msg_ends.pop()
+        for _ in range(self.partial_lines):
+            self.line_segments.pop()
+            self.line_starts.pop()
+            self.line_ends.pop()
+        if self.partial_segment:
+            self.segments.pop()
+        self.partial_turns = self.partial_lines = 0
+        self.partial_segment = False
+
+    def add_text(self, text, partial=False):
+        """Indexe les lignes de text avec les mêmes règles que l'ancien parse_dialogue (strip, ': ')."""
+        segment_id = len(self.segments)
+        self.segments.append(text)
+        turns = lines = 0
+        position = 0
+        for line in text.split("\n"):
+            line_start = position
+            position += len(line) + 1
+            stripped = line.strip()
+            if not stripped:
+                continue
+            self.line_segments.append(segment_id)
+            self.line_starts.append(line_start)
+            self.line_ends.append(line_start + len(line))
+            lines += 1
+            separator = stripped.find(": ")
+            if separator < 0:
+                continue
+            speaker = stripped[:separator]
+            speaker_id = self.speaker_ids.get(speaker)
+            if speaker_id is None:
+                # Liste des répliques d'abord : une vue qui lit ces listes trouve toujours les deux
+                speaker_id = len(self.speaker_names)
+                self.speaker_turns.append(array('I'))
+                self.speaker_names.append(speaker)
+                self.speaker_ids[speaker] = speaker_id
+            content_start = line_start + len(line) - len(line.lstrip())
+            self.speaker_turns[speaker_id].append(len(self.msg_starts))
+            self.turn_speakers.append(speaker_id)
+            self.turn_segments.append(segment_id)
+            self.msg_starts.append(content_start + separator + 2)
+            self.msg_ends.append(content_start + len(stripped))
+            turns += 1
+        if partial:
+            self.partial_turns, self.partial_lines, self.partial_segment = turns, lines, True
+
+class DialogueSnapshot:
+    """Vue en lecture seule d'un dialogue, figée à un instant donné.
+
+    La vue est liée à un _DialogueIndex et au nombre de répliques et de lignes
+    complètes qu'il contenait à cet instant : les ajouts ultérieurs au même
+    index (fichier qui a grandi) ou son remplacement (fichier réécrit) ne la
+    modifient pas. Les répliques de la dernière ligne sans fin de ligne, qui
+    seront retirées de l'index au prochain ajout, sont copiées dans la vue.
+    Plusieurs lectures successives (len() puis dialogue[i]) restent donc
+    cohérentes, même depuis un autre thread pendant un refresh().
+    """
+
+    def __init__(self, path, index=None, turn_count=0, line_count=0, partial_turns=(), partial_lines=()):
+        self.path = path
+        self._index = index or _DialogueIndex()
+        self._turn_count = turn_count      # répliques complètes de l'index visibles dans la vue
+        self._line_count = line_count
+        self._partial_turns = tuple(partial_turns)
+        self._partial_lines = tuple(partial_lines)
+        self._text = None
+
+    def snapshot(self):
+        return self
+
+    def _turn(self, index):
+        if index < self._turn_count:
+            return self._index.turn(index)
+        return self._partial_turns[index - self._turn_count]
+
+    def _speaker_indices(self, speaker):
+        """Indices des répliques complètes du personnage visibles dans la vue."""
+        speaker_id = self._index.speaker_ids.get(speaker)
+        if speaker_id is None:
+            return array('I')
+        turns = self._index.speaker_turns[speaker_id]
+        return turns[:bisect_left(turns, self._turn_count)]
+
+    def __len__(self):
+        return self._turn_count + len(self._partial_turns)
+
+    def __getitem__(self, index):
+        count = len(self)
+        if isinstance(index, slice):
+            return [self._turn(i) for i in range(*index.indices(count))]
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("index de réplique hors limites")
+        return self._turn(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._turn(i)
+
+    @property
+    def speakers(self):
+        """Personnages présents, dans l'ordre d'apparition."""
+        first_turns = {}
+        for name, turns in zip(list(self._index.speaker_names), list(self._index.speaker_turns)):
+            first = turns[:1]
+            if first and first[0] < self._turn_count:
+                first_turns[name] = first[0]
+        for position, (name, _) in enumerate(self._partial_turns, self._turn_count):
+            first_turns.setdefault(name, position)
+        return sorted(first_turns, key=first_turns.get)
+
+    def speaker_turn_count(self, speaker):
+        """Nombre de répliques du personnage."""
+        return len(self._speaker_indices(speaker)) + sum(1 for name, _ in self._partial_turns if name == speaker)
+
+    def tail(self, count):
+        """Retourne les count dernières répliques."""
+        return self[-count:] if count > 0 else []
+
+    def speaker_tail(self, speaker, count):
+        """Retourne les count dernières répliques du personnage."""
+        if count <= 0:
+            return []
+        turns = [self._index.turn(i) for i in self._speaker_indices(speaker)[-count:]]
+        turns.extend(turn for turn in self._partial_turns if turn[0] == speaker)
+        return turns[-count:]
+
+    @property
+    def line_count(self):
+        """Nombre de lignes non vides."""
+        return self._line_count + len(self._partial_lines)
+
+    def lines(self, start=0, stop=None):
+        """Retourne les lignes non vides [start:stop] telles qu'affichées."""
+        return [self._index.line(i) if i < self._line_count else self._partial_lines[i - self._line_count]
+                for i in range(*slice(start, stop).indices(self.line_count))]
+
+    @property
+    def text(self):
+        """Texte affichable (lignes non vides), construit une fois par vue."""
+        if self._text is None:
+            self._text = "\n".join(self.lines())
+        return self._text
+
+class DialogueStore:
+    """Dialogue parsé et indexé, mis à jour de façon incrémentale.
+
+    Les noms de personnages sont internés en petits entiers et les messages
+    sont conservés sous forme de positions dans des segments de texte
+    décodé plutôt que de chaînes séparées. Un index par personnage permet
+    d'obtenir les dernières répliques d'un personnage, la fin du dialogue ou
+    la liste des personnages en O(k) au lieu de O(fichier).
+
+    Le store se comporte comme une séquence de (speaker, message) : len(),
+    store[i] et store[-k:] fonctionnent. Le fichier n'est lu que pendant
+    refresh() : les lectures ne touchent jamais le fichier, même s'il est
+    réécrit entre-temps. Chaque lecture porte sur la version courante du
+    dialogue ; un traitement qui enchaîne plusieurs lectures (ou qui passe le
+    dialogue à un autre thread) doit utiliser snapshot(), car un refresh()
+    peut survenir entre deux lectures.
+    """
+
+    def __init__(self, file_path):
+        self.path = os.path.abspath(file_path)
+        self._index = None
+        self._snapshot = DialogueSnapshot(self.path)
+        self.size = 0
+        self.mtime_ns = 0
+        self.offset = 0                   # octets parsés jusqu'à la dernière fin de ligne
+        self.check = b""                  # derniers octets avant offset, pour détecter une réécriture
+
+    def snapshot(self):
+        """Vue en lecture seule de la version actuelle du dialogue (DialogueSnapshot)."""
+        return self._snapshot
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __getitem__(self, index):
+        return self._snapshot[index]
+
+    def __iter__(self):
+        return iter(self._snapshot)
+
+    @property
+    def speakers(self):
+        """Personnages présents, dans l'ordre d'apparition."""
+        return self._snapshot.speakers
+
+    def speaker_turn_count(self, speaker):
+        """Nombre de répliques du personnage."""
+        return self._snapshot.speaker_turn_count(speaker)
+
+    def tail(self, count):
+        """Retourne les count dernières répliques."""
+        return self._snapshot.tail(count)
+
+    def speaker_tail(self, speaker, count):
+        """Retourne les count dernières répliques du personnage."""
+        return self._snapshot.speaker_tail(speaker, count)
+
+    @property
+    def line_count(self):
+        """Nombre de lignes non vides."""
+        return self._snapshot.line_count
+
+    def lines(self, start=0, stop=None):
+        """Retourne les lignes non vides [start:stop] telles qu'affichées."""
+        return self._snapshot.lines(start, stop)
+
+    @property
+    def text(self):
+        """Texte affichable (lignes non vides), construit une fois par version du fichier."""
+        return self._snapshot.text
+
+    def close(self):
+        """Oublie le contenu parsé ; le prochain refresh() reparse le fichier."""
+        self.__init__(self.path)
+
+    def refresh(self):
+        """Met le store à jour avec le fichier : rien si inchangé, parse incrémental s'il a grandi."""
+        stat = os.stat(self.path)
+        if self._index is not None and self.size == stat.st_size and self.mtime_ns == stat.st_mtime_ns:
+            return self
+
+        with open(self.path, 'rb') as f:
+            index = self._index
+            offset, check = self.offset, self.check
+            if index is not None and stat.st_size > self.size and check:
+                f.seek(offset - len(check))
+                if f.read(len(check)) != check:
+                    index = None
+            elif stat.st_size <= self.size:
+                index = None
+            if index is None:
+                # Premier parse, ou fichier tronqué ou réécrit : nouvel index, substitué à la fin
+                index = _DialogueIndex()
+                offset, check = 0, b""
+            else:
+                index.drop_partial()
+            f.seek(offset)
+            pending = b""
+            # Lecture par blocs coupés en fin de ligne pour borner la mémoire
+            while True:
+                block = f.read(_DIALOGUE_CHUNK_BYTES)
+                if not block:
+                    break
+                data = pending + block if pending else block
+                cut = _line_boundary(data)
+                if cut == 0:
+                    pending = data
+                    continue
+                index.add_text(_decode_lines(data[:cut])[:-1])  # sans la fin de ligne finale
+                check = (check + data[max(0, cut - _DIALOGUE_CHECK_BYTES):cut])[-_DIALOGUE_CHECK_BYTES:]
+                offset += cut
+                pending = data[cut:]
+            if pending:
+                # Dernière ligne sans fin de ligne : comptée, mais reparsée au prochain ajout
+                index.add_text(_decode_lines(pending, errors='replace'), partial=True)
+
+        # Les entrées en deçà des répliques partielles ne changent plus : la vue les lit dans l'index
+        turn_count = len(index.msg_starts) - index.partial_turns
+        line_count = len(index.line_starts) - index.partial_lines
+        self._snapshot = DialogueSnapshot(self.path, index, turn_count, line_count,
+                                          [index.turn(i) for i in range(turn_count, len(index.msg_starts))],
+                                          [index.line(i) for i in range(line_count, len(index.line_starts))])
+        self._index = index
+        self.offset, self.check = offset, check
+        self.size = offset + len(pending)
+        self.mtime_ns = stat.st_mtime_ns
+        return self
+
+def get_dialogue(file_path):
+    """Retourne le DialogueStore à jour pour le fichier de dialogue.
+
+    Le store est mis en cache : un fichier inchangé n'est pas relu, un fichier
+    qui a grandi n'est parsé qu'à partir de la dernière position lue, et un
+    fichier tronqué ou réécrit est reparsé entièrement. Au-delà de
+    DIALOGUE_CACHE_SIZE fichiers, les moins récemment utilisés sont oubliés.
+    """
+    key = os.path.abspath(file_path)
+    with _dialogue_cache_lock:
+        store = _dialogue_cache.get(key)
+        if store is None:
+            store = DialogueStore(key)
+            _dialogue_cache[key] = store
+            while len(_dialogue_cache) > DIALOGUE_CACHE_SIZE:
+                _dialogue_cache.popitem(last=False)
+        else:
+            _dialogue_cache.move_to_end(key)
+        try:
+            return store.refresh()
+        except (OSError, ValueError):
+            _dialogue_cache.pop(key, None)
+            raise
+
+def invalidate_dialogue_cache(file_path=None):
+    """Oublie le dialogue parsé pour file_path, ou tout le cache si file_path est None."""
+    with _dialogue_cache_lock:
+        if file_path is None:
+            _dialogue_cache.clear()
+        else:
+            _dialogue_cache.pop(os.path.abspath(file_path), None)
+
+def _refresh_cached_dialogue(file_path):
+    """Met à jour le dialogue parsé s'il est en cache (parse incrémental), sans le créer sinon."""
+    key = os.path.abspath(file_path)
+    with _dialogue_cache_lock:
+        store = _dialogue_cache.get(key)
+        if store is None:
+            return
+        try:
+            store.refresh()
+        except (OSError, ValueError):
+            _dialogue_cache.pop(key, None)
+
 def parse_dialogue(file_path):
     """Parse le fichier de dialogue en liste de (speaker, message)."""
-    dialogue = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if ': ' in line:
-                speaker, message = line.split(': ', 1)
-                dialogue.append((speaker, message))
-    return dialogue
+    return list(get_dialogue(file_path))
+
+def get_dialogue_text(file_path):
+    """Retourne le texte du dialogue sans lignes vides, pour l'affichage."""
+    return get_dialogue(file_path).text
+
+DIALOGUE_PAGE_LINES = 200
+
+def get_dialogue_window(file_path, pages=1, page_size=DIALOGUE_PAGE_LINES):
+    """Retourne la fin du dialogue à afficher : (lignes, index de la première ligne, nombre total de lignes).
+
+    Seules les pages * page_size dernières lignes non vides sont décodées,
+    depuis le DialogueStore partagé avec la génération.
+    """
+    dialogue = get_dialogue(file_path).snapshot()
+    total = dialogue.line_count
+    start = max(0, total - pages * page_size)
+    return dialogue.lines(start, total), start, total
 
 def get_speakers(dialogue_data):
     """Retourne la liste des speakers uniques dans le dialogue.
     dialogue_data peut être soit une liste de tuples (speaker, message) 
     soit un chemin de fichier à parser."""
     if isinstance(dialogue_data, str):
-        # Si c'est un chemin de fichier, le parser d'abord
-        dialogue_data = parse_dialogue(dialogue_data)
-    return list(set(speaker for speaker, _ in dialogue_data))
+        # Si c'est un chemin de fichier, utiliser le dialogue parsé en cache
+        return list(get_dialogue(dialogue_data).speakers)
+    return list(dict.fromkeys(speaker for speaker, _ in dialogue_data))
 
 # Exemple d'utilisation de Path pour un fichier (à adapter selon besoin)
 def get_file_path(filename):
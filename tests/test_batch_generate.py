@@ -0,0 +1,37 @@
+"""Génération en lot : un fichier illisible ne doit pas interrompre le lot."""
+from pathlib import Path
+import json
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import batch_generate  # noqa: E402
+
+
+def fake_responses(model_name, character, dialogue, *args, num_responses=3, **kwargs):
+    return [f"réponse {i} de {character}" for i in range(num_responses)]
+
+
+def test_unreadable_files_become_failed_records(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_generate, "generate_multiple_responses", fake_responses)
+    folder = tmp_path / "dialogues"
+    folder.mkdir()
+    (folder / "bon.txt").write_text("Alice: bonjour\nBob: salut\n", encoding='utf-8')
+    (folder / "illisible.txt").write_bytes(b"Alice: \xff\n")
+    jobs_path = tmp_path / "taches.jsonl"
+    jobs_path.write_text(json.dumps({'file': str(tmp_path / "absent.txt")}) + "\n", encoding='utf-8')
+
+    jobs = list(batch_generate.jobs_from_dirs([str(folder)], num_responses=2))
+    jobs += list(batch_generate.jobs_from_jsonl(str(jobs_path)))
+    output = tmp_path / "sorties.jsonl"
+    summary = batch_generate.run_batch(jobs, "modele", str(output))
+
+    records = {Path(record['file']).name: record for record in map(json.loads, output.read_text(encoding='utf-8').splitlines())
+               if not record['ok']}
+    assert sorted(records) == ["absent.txt", "illisible.txt"]
+    assert records["illisible.txt"]['error'].startswith("UnicodeDecodeError")
+    assert records["absent.txt"]['error'].startswith("FileNotFoundError")
+    assert summary['jobs'] == 4
+    assert summary['generations'] == 4
+    assert summary['errors'] == 2
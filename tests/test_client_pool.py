@@ -0,0 +1,135 @@
+"""Pool de clients Ollama testé contre le serveur simulé de benchmarks/fake_ollama.py."""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import socket
+import sys
+
+import httpx
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from ollama import ResponseError  # noqa: E402
+from fake_ollama import FakeOllamaServer  # noqa: E402
+from ollama_utils import OllamaClientPool  # noqa: E402
+
+MODEL = "fake:latest"
+MESSAGES = [{'role': 'user', 'content': "Bonjour"}]
+
+
+def free_port():
+    """Port local sur lequel rien n'écoute (hôte injoignable)."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def server():
+    with FakeOllamaServer(models=[MODEL], token_latency=0.0, max_concurrency=4) as fake:
+        yield fake
+
+
+@pytest.fixture
+def pools():
+    created = []
+
+    def make(hosts):
+        pool = OllamaClientPool(hosts, health_interval=0, health_timeout=1)
+        created.append(pool)
+        return pool
+    yield make
+    for pool in created:
+        pool.close()
+
+
+def host_stats(pool, url):
+    return next(stats for stats in pool.stats() if stats['url'] == url)
+
+
+def test_failover_to_live_host(server, pools):
+    dead = f"http://127.0.0.1:{free_port()}"
+    # Le poids élevé fait choisir l'hôte injoignable en premier
+    pool = pools([{'url': dead, 'weight': 10}, {'url': server.url, 'weight': 1}])
+    response = pool.chat(model=MODEL, messages=MESSAGES, options={'num_predict': 3})
+    assert response['message']['content']
+    assert host_stats(pool, dead)['healthy'] is False
+    assert host_stats(pool, dead)['failures'] == 1
+    assert all(stats['in_flight'] == 0 for stats in pool.stats())
+    # L'hôte indisponible n'est plus choisi tant qu'il n'est pas rétabli
+    pool.chat(model=MODEL, messages=MESSAGES, options={'num_predict': 3})
+    assert host_stats(pool, dead)['failures'] == 1
+
+
+def test_missing_model_error_wins_over_unreachable_host(server, pools):
+    dead = f"http://127.0.0.1:{free_port()}"
+    pool = pools([{'url': server.url, 'weight': 10}, {'url': dead, 'weight': 1}])
+    with pytest.raises(ResponseError) as excinfo:
+        pool.chat(model="absent:latest", messages=MESSAGES)
+    assert excinfo.value.status_code == 404
+
+
+def test_weighted_routing(pools):
+    # Requêtes simultanées : la charge (requêtes en cours / poids) répartit 3 pour 1
+    with FakeOllamaServer(models=[MODEL], token_latency=0.1, max_concurrency=8) as heavy, \
+            FakeOllamaServer(models=[MODEL], token_latency=0.1, max_concurrency=8) as light:
+        pool = pools([{'url': heavy.url, 'weight': 3}, {'url': light.url, 'weight': 1}])
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda _: pool.chat(model=MODEL, messages=MESSAGES, options={'num_predict': 2}), range(8)))
+        assert (heavy.requests, light.requests) == (6, 2)
+
+
+def test_health_check_recovers_host(pools):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    pool = pools([{'url': url, 'weight': 1}])
+    pool.check_health()
+    assert pool.healthy_hosts() == []
+    with FakeOllamaServer(port=port, models=[MODEL]):
+        pool.check_health()
+        assert [host.url for host in pool.healthy_hosts()] == [url]
+
+
+def test_stream_failover_before_first_chunk(server, pools):
+    dead = f"http://127.0.0.1:{free_port()}"
+    pool = pools([{'url': dead, 'weight': 10}, {'url': server.url, 'weight': 1}])
+    chunks = list(pool.chat(model=MODEL, messages=MESSAGES, stream=True, options={'num_predict': 4}))
+    assert "".join(chunk['message']['content'] for chunk in chunks)
+    assert chunks[-1]['done']
+    assert host_stats(pool, dead)['healthy'] is False
+    assert all(stats['in_flight'] == 0 for stats in pool.stats())
+
+
+def test_stream_released_when_closed_or_dropped(server, pools):
+    pool = pools([{'url': server.url, 'weight': 1}])
+    stream = pool.chat(model=MODEL, messages=MESSAGES, stream=True, options={'num_predict': 4})
+    next(stream)
+    assert host_stats(pool, server.url)['in_flight'] == 1
+    stream.close()
+    assert host_stats(pool, server.url)['in_flight'] == 0
+    # Flux jamais lu : aucun hôte n'est réservé
+    pool.chat(model=MODEL, messages=MESSAGES, stream=True)
+    assert host_stats(pool, server.url)['in_flight'] == 0
+
+
+def test_client_side_error_leaves_hosts_healthy(pools):
+    with FakeOllamaServer(models=[MODEL]) as first, FakeOllamaServer(models=[MODEL]) as second:
+        pool = pools([{'url': first.url, 'weight': 1}, {'url': second.url, 'weight': 1}])
+        with pytest.raises(Exception) as excinfo:
+            pool.chat(model=MODEL, messages=MESSAGES, options=42)
+        assert not isinstance(excinfo.value, (ConnectionError, ResponseError))
+        assert (first.requests, second.requests) == (0, 0)
+        assert all(stats['healthy'] and stats['failures'] == 0 and stats['in_flight'] == 0 for stats in pool.stats())
+
+
+def test_read_timeout_is_not_retried(pools):
+    # Génération trop longue pour le délai : l'hôte est lent, pas indisponible
+    with FakeOllamaServer(models=[MODEL], token_latency=0.5) as slow, FakeOllamaServer(models=[MODEL]) as other:
+        pool = pools([{'url': slow.url, 'weight': 10}, {'url': other.url, 'weight': 1}])
+        with pytest.raises(httpx.ReadTimeout):
+            pool.chat(timeout=0.2, model=MODEL, messages=MESSAGES, options={'num_predict': 4})
+        assert other.requests == 0
+        assert host_stats(pool, slow.url)['healthy'] is True
+        assert host_stats(pool, slow.url)['in_flight'] == 0
@@ -0,0 +1,84 @@
+"""DialogueStore : vues figées et lectures concurrentes d'un refresh()."""
+from pathlib import Path
+import os
+import sys
+import threading
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from ollama_utils import DialogueStore, build_dialogue_context, pack_recent_turns, predict_next_speaker  # noqa: E402
+
+SPEAKERS = ("Alice", "Bob", "Claire")
+
+
+def write(path, start, count, mode='w', tail=""):
+    with open(path, mode, encoding='utf-8') as f:
+        f.write("".join(f"{SPEAKERS[i % len(SPEAKERS)]}: réplique numéro {i}\n" for i in range(start, start + count)) + tail)
+
+
+def test_snapshot_is_unchanged_by_append_and_rewrite(tmp_path):
+    path = tmp_path / "dialogue.txt"
+    write(path, 0, 5, tail="Alice: en cours")
+    store = DialogueStore(path).refresh()
+    snapshot = store.snapshot()
+    expected = list(snapshot)
+    assert len(expected) == 6 and expected[-1] == ("Alice", "en cours")
+
+    # Ajout : la dernière ligne partielle est reparsée dans l'index partagé
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(" de frappe\nBob: suite\n")
+    store.refresh()
+    assert store[-2:] == [("Alice", "en cours de frappe"), ("Bob", "suite")]
+    assert list(snapshot) == expected
+    assert snapshot.speaker_tail("Alice", 1) == [("Alice", "en cours")]
+    assert snapshot.line_count == 6
+
+    # Réécriture : nouvel index, la vue garde l'ancien
+    write(path, 100, 2)
+    store.refresh()
+    assert len(store) == 2
+    assert list(snapshot) == expected
+    assert snapshot.speakers == list(SPEAKERS)
+
+
+def test_concurrent_readers_during_refresh(tmp_path):
+    path = tmp_path / "dialogue.txt"
+    write(path, 0, 400)
+    store = DialogueStore(path).refresh()
+    errors = []
+    stop = threading.Event()
+
+    def writer():
+        try:
+            for step in range(300):
+                if step % 2:
+                    write(path, step, 3, mode='a', tail="Bob: partiel" if step % 3 else "")
+                else:
+                    write(path, step, 50 + step % 200)  # fichier tronqué puis réécrit
+                os.utime(path, ns=(step, step))
+                store.refresh()
+        finally:
+            stop.set()
+
+    def reader():
+        while not stop.is_set():
+            try:
+                snapshot = store.snapshot()
+                start, turns = pack_recent_turns(snapshot, 200)
+                assert turns == snapshot[start:]
+                build_dialogue_context(store, context_budget=200, summarize=False)
+                predict_next_speaker(snapshot)
+                snapshot.speakers
+                snapshot.lines(max(0, snapshot.line_count - 20))
+            except Exception as e:
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    writer()
+    for thread in threads:
+        thread.join()
+    assert errors == []
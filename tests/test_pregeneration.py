@@ -0,0 +1,74 @@
+"""Planificateur de pré-génération, avec une génération simulée (sans Ollama)."""
+from pathlib import Path
+import sys
+import time
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import ollama_utils  # noqa: E402
+from ollama_utils import PregenerationScheduler  # noqa: E402
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("délai dépassé")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def generations(monkeypatch):
+    """Remplace la génération : enregistre les appels et lève l'erreur placée dans failures."""
+    calls = []
+    failures = []
+
+    def fake_generate(model_name, character, dialogue, system_prompt="", user_prompt="", options=None, **kwargs):
+        calls.append((model_name, character, len(dialogue)))
+        if failures:
+            raise failures.pop(0)
+        return f"{model_name} : réponse de {character}", "instruction"
+    monkeypatch.setattr(ollama_utils, "generate_dialogue_response", fake_generate)
+    return calls, failures
+
+
+def write_dialogue(path, text):
+    path.write_text(text, encoding='utf-8')
+    ollama_utils.invalidate_dialogue_cache(path)
+    return str(path)
+
+
+def test_failed_job_does_not_stop_the_worker(tmp_path, generations):
+    calls, failures = generations
+    failures.append(IndexError("index de réplique hors limites"))
+    path = write_dialogue(tmp_path / "dialogue.txt", "Alice: bonjour\nBob: salut\nAlice: ça va ?\n")
+    scheduler = PregenerationScheduler()
+    scheduler.configure("modele")
+    scheduler.set_active(path)
+    wait_until(lambda: scheduler.stats['cancelled'] == 1)
+    assert scheduler._thread.is_alive()
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write("Bob: très bien\nAlice: tant mieux\n")
+    scheduler.on_file_changed(path)
+    wait_until(lambda: scheduler.stats['completed'] == 1)
+    assert len(calls) == 2
+    assert scheduler.take(path, "Bob") == ("modele : réponse de Bob", "instruction")
+
+
+def test_sessions_keep_their_own_file_and_settings(tmp_path, generations):
+    path = write_dialogue(tmp_path / "dialogue.txt", "Alice: bonjour\nBob: salut\nAlice: ça va ?\n")
+    scheduler = PregenerationScheduler()
+    scheduler.configure("modele-a", session="a")
+    scheduler.set_active(path, session="a")
+    wait_until(lambda: scheduler.ready(path, session="a") == ["Bob"])
+
+    # Rerun d'une autre session : autres réglages, pré-génération désactivée
+    scheduler.configure("modele-b", session="b")
+    scheduler.set_active(None, session="b")
+    assert scheduler.ready(path, session="a") == ["Bob"]
+    assert scheduler.take(path, "Bob", session="b") is None
+    assert scheduler.take(path, "Bob", session="a") == ("modele-a : réponse de Bob", "instruction")